@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+from api.db import close_unusable_connections
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_DB_THREADS,
+            thread_name_prefix='async-db',
+        )
+    return _executor
+
+
+def is_asgi_request(request):
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def to_async(view):
+    """
+    Асинхронная обертка над синхронным view: запрос целиком
+    (включая запросы к БД и рендеринг ответа) выполняется
+    в ограниченном пуле потоков, не блокируя цикл событий.
+    """
+
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        close_unusable_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(
+            run, thread_sensitive=False, executor=get_executor(),
+        )(request, *args, **kwargs)
+
+    return async_view
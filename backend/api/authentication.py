@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from api.metrics import record_cache
+
+# Поля пользователя, которые хранятся в кэше токенов. Хэш пароля
+# и меняющиеся без участия пользователя поля (last_login, счетчики)
+# в кэш не попадают и читаются из БД при обращении к ним.
+CACHED_USER_FIELDS = frozenset({
+    'id', 'username', 'email', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser',
+})
+
+
+def token_cache_key(key):
+    return f'auth:token:{sha256(key.encode()).hexdigest()}'
+
+
+class LocalTokenCache:
+    """
+    LRU токенов в памяти процесса с коротким временем жизни.
+    Другие процессы узнают об удалении токена не позже
+    чем через AUTH_TOKEN_LOCAL_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, token = item
+            if expires < monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return token
+
+    def set(self, key, token):
+        with self._lock:
+            self._data[key] = (
+                monotonic() + settings.AUTH_TOKEN_LOCAL_TTL, token
+            )
+            self._data.move_to_end(key)
+            while len(self._data) > settings.AUTH_TOKEN_LOCAL_SIZE:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_tokens = LocalTokenCache()
+
+
+def invalidate_token(key):
+    """Удаляет токен из кэша процесса и общего кэша."""
+    local_tokens.delete(key)
+    if settings.CACHE_IS_SHARED:
+        cache.delete(token_cache_key(key))
+
+
+def cached_user_fields():
+    """Кэшируемые поля в порядке полей модели (как ждет Model.from_db)."""
+    return [
+        field.attname for field in get_user_model()._meta.concrete_fields
+        if field.attname in CACHED_USER_FIELDS
+    ]
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшированием полей пользователя
+    из CACHED_USER_FIELDS в памяти процесса и, если кэш Django общий
+    для процессов (Redis), в нем. Остальные поля пользователя отложены
+    и загружаются из БД при обращении. Кэш сбрасывается при выходе,
+    изменении кэшируемых полей или удалении пользователя.
+    Без общего кэша сброс виден только
+    в своем процессе, поэтому токены живут лишь в кэше процесса
+    с коротким AUTH_TOKEN_LOCAL_TTL.
+    """
+
+    def authenticate_credentials(self, key):
+        values = local_tokens.get(key)
+        record_cache('tokens_local', values is not None)
+        if values is None:
+            if settings.CACHE_IS_SHARED:
+                values = cache.get(token_cache_key(key))
+                record_cache('tokens', values is not None)
+            if values is None:
+                values = self.get_user_values(key)
+                if settings.CACHE_IS_SHARED:
+                    cache.set(
+                        token_cache_key(key), values,
+                        settings.AUTH_TOKEN_CACHE_TIMEOUT,
+                    )
+            local_tokens.set(key, values)
+        # Каждый запрос получает свои объекты: кэш процесса общий
+        # для потоков.
+        model = get_user_model()
+        user = model.from_db(model.objects.db, cached_user_fields(), values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                'Пользователь неактивен или удален.'
+            )
+        token_model = self.get_model()
+        token = token_model.from_db(
+            token_model.objects.db, ['key', 'user_id'], [key, user.pk],
+        )
+        token.user = user
+        return (user, token)
+
+    def get_user_values(self, key):
+        values = self.get_model().objects.filter(key=key).values_list(
+            *(f'user__{field}' for field in cached_user_fields())
+        ).first()
+        if values is None:
+            raise exceptions.AuthenticationFailed('Недействительный токен.')
+        return values
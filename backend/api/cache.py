@@ -0,0 +1,113 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from api.metrics import record_cache
+from recipes.models import Tag
+
+GENERATION_KEY = 'recipes:generation'
+INGREDIENTS_GENERATION_KEY = 'ingredients:generation'
+TAGS_GENERATION_KEY = 'tags:generation'
+PANTRY_GENERATION_KEY = 'pantry:generation'
+PANTRY_CHANGES_KEY = 'pantry:changes'
+HITS_KEY = 'recipes:cache:hits'
+MISSES_KEY = 'recipes:cache:misses'
+
+
+def _incr(key):
+    """Атомарно увеличивает счетчик, создавая его при отсутствии."""
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+        return 1
+
+
+def get_generation(key=GENERATION_KEY):
+    return cache.get_or_set(key, 1, None)
+
+
+def bump_generation(key=GENERATION_KEY):
+    """Инвалидирует все данные, версионируемые счетчиком key."""
+    return _incr(key)
+
+
+def get_tag_ids_by_slug():
+    """
+    Справочник тэгов slug -> id, версионируемый счетчиком тэгов.
+    Ограниченное время жизни - страховка на случай кэша, не общего
+    для процессов: новый тэг появится в фильтре не позже чем через
+    TAGS_CACHE_TIMEOUT секунд.
+    """
+    key = f'tags:slugs:{get_generation(TAGS_GENERATION_KEY)}'
+    tag_ids = cache.get(key)
+    record_cache('tags', tag_ids is not None)
+    if tag_ids is None:
+        tag_ids = dict(
+            Tag.objects.exclude(slug=None).values_list('slug', 'id')
+        )
+        cache.set(key, tag_ids, settings.TAGS_CACHE_TIMEOUT)
+    return tag_ids
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses}
+
+
+def make_cache_key(request, action, pk=None):
+    """
+    Ключ кэша по нормализованной строке запроса. Хост и схема
+    входят в ключ: в ответе абсолютные ссылки (изображения,
+    next/previous), а сайт доступен по IP и по домену.
+    """
+    query = '&'.join(
+        f'{name}={value}'
+        for name, values in sorted(request.query_params.lists())
+        for value in sorted(values)
+    )
+    digest = md5(
+        f'{request.scheme}://{request.get_host()}:{action}:{pk}:{query}'
+        .encode()
+    ).hexdigest()
+    return f'recipes:{get_generation()}:{digest}'
+
+
+class AnonymousCacheMixin:
+    """
+    Кэширование list/retrieve для анонимных пользователей.
+    Ключи версионируются счетчиком поколения, который
+    увеличивается при изменении рецептов, ингредиентов и тэгов.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        key = make_cache_key(request, self.action, kwargs.get('pk'))
+        data = cache.get(key)
+        record_cache('recipes', data is not None)
+        if data is not None:
+            _incr(HITS_KEY)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        _incr(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RECIPES_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
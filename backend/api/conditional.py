@@ -0,0 +1,50 @@
+from calendar import timegm
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    Поддержка условных GET-запросов (If-None-Match / If-Modified-Since)
+    для list и retrieve. Вьюсет определяет get_conditional_state,
+    возвращающий составные части ETag и дату изменения (или None).
+    """
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = None
+        parts, last_modified = self.get_conditional_state(
+            request, *args, **kwargs
+        )
+        if parts is not None:
+            etag = quote_etag(md5(
+                ':'.join(str(part) for part in parts).encode()
+            ).hexdigest())
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        )
+        if response is not None:
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            if etag is not None:
+                response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavouriteRecipe, Recipe, ShoppingCart
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счетчик одним UPDATE ... SET field = field + delta."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        # Не уходим в минус, если счетчик уже разошелся с данными.
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def count_related(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+# Модель -> {счетчик: (связанная модель, поле связи)}.
+COUNTERS = {
+    Recipe: {
+        'favorites_count': (FavouriteRecipe, 'recipe'),
+        'in_carts_count': (ShoppingCart, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Subscribe, 'author'),
+    },
+}
+
+
+def recount():
+    """
+    Пересчитывает счетчики, разошедшиеся с данными.
+    Возвращает число исправленных строк по каждому счетчику.
+    """
+    repaired = {}
+    for model, counters in COUNTERS.items():
+        for field, (related, link) in counters.items():
+            actual = count_related(related, link)
+            drifted = model.objects.annotate(actual=actual).exclude(
+                **{field: F('actual')}
+            ).values_list('pk', flat=True)
+            repaired[f'{model._meta.label}.{field}'] = (
+                model.objects.filter(pk__in=list(drifted)).update(
+                    **{field: actual}
+                )
+            )
+    return repaired
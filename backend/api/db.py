@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db import connections
+
+
+def close_unusable_connections(**kwargs):
+    """
+    Проверка постоянных соединений с БД перед запросом.
+    Соединение, разорванное сервером БД или pgbouncer за время простоя,
+    закрывается заранее и открывается заново при первом запросе к БД,
+    вместо ошибки посреди обработки запроса.
+    """
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (connection.connection is not None
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import FeedEntry, Recipe
+from users.models import ProjectUser, Subscribe
+
+
+def is_popular(author_id):
+    """Рецепты популярных авторов подтягиваются в ленту при чтении."""
+    followers = ProjectUser.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    return (followers or 0) >= settings.FEED_FANOUT_LIMIT
+
+
+def add_to_feeds(user_ids, recipe_ids):
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in recipe_ids
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def fan_out(recipe):
+    """Рассылает новый рецепт в ленты подписчиков автора."""
+    if recipe.author_id is None or is_popular(recipe.author_id):
+        return
+    add_to_feeds(
+        Subscribe.objects.filter(author_id=recipe.author_id).values_list(
+            'user_id', flat=True
+        ).iterator(),
+        [recipe.id],
+    )
+
+
+def follow(user_id, author_id):
+    """Добавляет в ленту последние рецепты нового автора."""
+    add_to_feeds([user_id], Recipe.objects.filter(
+        author_id=author_id
+    ).order_by('-id').values_list('id', flat=True)[:settings.FEED_BACKFILL])
+
+
+def unfollow(user_id, author_id):
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def pull_popular(user):
+    """
+    Дописывает в ленту новые рецепты популярных авторов,
+    по которым рассылка при публикации не выполняется.
+    Отметка последнего подтянутого рецепта хранится в кэше.
+    """
+    authors = list(Subscribe.objects.filter(
+        user=user,
+        author__followers_count__gte=settings.FEED_FANOUT_LIMIT,
+    ).values_list('author_id', flat=True))
+    if not authors:
+        return
+    key = f'feed:pulled:{user.id}'
+    recipes = Recipe.objects.filter(author_id__in=authors)
+    pulled = cache.get(key)
+    if pulled is not None:
+        recipes = recipes.filter(id__gt=pulled)
+    recipe_ids = list(recipes.order_by('-id').values_list(
+        'id', flat=True
+    )[:settings.FEED_BACKFILL])
+    if recipe_ids:
+        add_to_feeds([user.id], recipe_ids)
+        cache.set(key, recipe_ids[0], None)
@@ -0,0 +1,55 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+# Защита Pillow от "бомб декомпрессии" и в фоновой обработке изображений.
+Image.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Изображение рецепта: строка base64 или файл, уже декодированный
+    Base64JSONParser. Размер и число пикселей проверяются
+    по заголовку изображения, до его полного декодирования.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            if len(data) * 3 // 4 > settings.MAX_IMAGE_UPLOAD_SIZE:
+                raise serializers.ValidationError(
+                    'Размер изображения превышает '
+                    f'{settings.MAX_IMAGE_UPLOAD_SIZE} байт.'
+                )
+            file = super().to_internal_value(data)
+            if file is not None:
+                self.check_pixels(file)
+            return file
+        if not isinstance(data, UploadedFile):
+            return super().to_internal_value(data)
+        image_format = self.check_pixels(data)
+        extension = 'jpg' if image_format == 'jpeg' else image_format
+        if extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        data.name = f'{uuid4()}.{extension}'
+        return serializers.ImageField.to_internal_value(self, data)
+
+    def check_pixels(self, file):
+        """Проверяет число пикселей по заголовку, возвращает формат."""
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+                image_format = (image.format or '').lower()
+        except (OSError, Image.DecompressionBombError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        finally:
+            file.seek(0)
+        if width * height > settings.MAX_IMAGE_PIXELS:
+            raise serializers.ValidationError(
+                f'Изображение больше {settings.MAX_IMAGE_PIXELS} пикселей.'
+            )
+        return image_format
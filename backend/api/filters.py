@@ -1,22 +1,50 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
+from api.cache import get_tag_ids_by_slug
+from api.search import search_recipes
 from recipes.models import Recipe
 
 
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids_by_slug()]
+
+
 class RecipeFilter(FilterSet):
     """Фильтры к модели рецептов"""
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='tags_filter',
+    )
     is_favorited = filters.BooleanFilter(
         method='is_favorited_filter',
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter',
     )
+    search = filters.CharFilter(
+        method='search_filter',
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='ordering_filter',
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def tags_filter(self, queryset, name, value):
+        tag_ids = get_tag_ids_by_slug()
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tag_id__in=[
+                    tag_ids[slug] for slug in value if slug in tag_ids
+                ],
+            )
+        ))
+
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
@@ -28,3 +56,10 @@ class RecipeFilter(FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def ordering_filter(self, queryset, name, value):
+        # По индексу recipe_popular_idx, без COUNT по избранному.
+        return queryset.order_by('-favorites_count', '-id')
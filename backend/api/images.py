@@ -0,0 +1,141 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+from pathlib import PurePosixPath
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import bump_generation
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Название версии изображения -> максимальный размер (ширина, высота).
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+RENDITIONS_DIR = 'recipes/renditions'
+
+_executor = None
+
+
+def get_executor():
+    """
+    Пул отдельных процессов: декодирование и сжатие изображений
+    не занимают GIL и потоки веб-воркера. Процессы запускаются
+    через spawn и сами настраивают Django, не наследуя
+    соединения с базой данных родителя.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+    return _executor
+
+
+def submit(recipe_id):
+    global _executor
+    try:
+        get_executor().submit(_run, recipe_id)
+    except BrokenProcessPool:
+        # Процесс пула упал (например, по нехватке памяти): пул пересоздается.
+        logger.exception('Пул обработки изображений перезапущен')
+        _executor = None
+        get_executor().submit(_run, recipe_id)
+
+
+def needs_renditions(recipe):
+    return bool(recipe.image) and (
+        recipe.image_renditions.get('source') != recipe.image.name
+    )
+
+
+def schedule_renditions(recipe):
+    """Ставит построение версий изображения в очередь после коммита."""
+    if settings.IMAGE_RENDITIONS_ASYNC:
+        transaction.on_commit(partial(submit, recipe.id))
+    else:
+        transaction.on_commit(partial(build_renditions, recipe.id))
+
+
+def _run(recipe_id):
+    try:
+        build_renditions(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', recipe_id)
+    finally:
+        connection.close()
+
+
+def build_renditions(recipe_id):
+    """Строит уменьшенные версии изображения рецепта."""
+    recipe = Recipe.objects.filter(id=recipe_id).only(
+        'image', 'image_renditions',
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    image_format = settings.IMAGE_RENDITION_FORMAT
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    stem = PurePosixPath(source).stem
+    renditions = {'source': source}
+    with recipe.image.open('rb') as file, Image.open(file) as original:
+        original.load()
+        if image_format == 'JPEG':
+            original = original.convert('RGB')
+        for name, size in RENDITIONS.items():
+            image = original.copy()
+            image.thumbnail(size)
+            buffer = BytesIO()
+            image.save(buffer, image_format, quality=82)
+            path = default_storage.save(
+                f'{RENDITIONS_DIR}/{stem}_{name}.{extension}',
+                ContentFile(buffer.getvalue()),
+            )
+            renditions[name] = path
+    # Обновляем только если изображение не сменилось за время обработки.
+    updated = Recipe.objects.filter(id=recipe_id, image=source).update(
+        image_renditions=renditions,
+        updated_at=timezone.now(),
+    )
+    if updated:
+        bump_generation()
+        delete_renditions(recipe.image_renditions, keep=renditions)
+    else:
+        delete_renditions(renditions)
+
+
+def delete_renditions(renditions, keep=None):
+    """Удаляет файлы версий изображения, кроме тех, что есть в keep."""
+    keep = set((keep or {}).values())
+    for name, path in renditions.items():
+        if name != 'source' and path not in keep:
+            default_storage.delete(path)
+
+
+def rendition_url(recipe, name, request=None):
+    """URL версии изображения, а пока ее нет - оригинала."""
+    if not recipe.image:
+        return None
+    renditions = recipe.image_renditions
+    if renditions.get('source') == recipe.image.name and name in renditions:
+        url = default_storage.url(renditions[name])
+    else:
+        url = recipe.image.url
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
@@ -0,0 +1,304 @@
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+
+from django.core.cache import cache
+
+from api.cache import (GENERATION_KEY, INGREDIENTS_GENERATION_KEY,
+                       PANTRY_CHANGES_KEY, PANTRY_GENERATION_KEY,
+                       bump_generation, get_generation)
+from recipes.models import Ingredient, IngredientInRecipe, Recipe
+
+WORD_RE = re.compile(r'\w+')
+# Веса полей как у весов A, B, C в ts_rank PostgreSQL по умолчанию.
+SEARCH_WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+# Журнал изменений рецептов для индекса по ингредиентам:
+# сколько записей применять по одной и сколько их хранить (секунды).
+PANTRY_CHANGES_LIMIT = 1000
+PANTRY_CHANGE_TIMEOUT = 24 * 60 * 60
+
+
+class IngredientIndex:
+    """
+    Отсортированный индекс ингредиентов в памяти процесса
+    для автодополнения по названию.
+    Загружается при первом обращении и перестраивается,
+    когда меняется счетчик поколения ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._generation = None
+        self._data = ([], [])
+
+    def _load(self):
+        generation = get_generation(INGREDIENTS_GENERATION_KEY)
+        if generation == self._generation:
+            return self._data
+        with self._lock:
+            if generation != self._generation:
+                rows = sorted(
+                    (name.casefold(), pk, name, measurement_unit)
+                    for pk, name, measurement_unit
+                    in Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit',
+                    )
+                )
+                self._data = (
+                    [row[0] for row in rows],
+                    [
+                        {'id': pk, 'name': name, 'measurement_unit': unit}
+                        for _, pk, name, unit in rows
+                    ],
+                )
+                self._generation = generation
+        return self._data
+
+    def search(self, query, limit):
+        """
+        Сначала ингредиенты, начинающиеся с query,
+        затем содержащие query в середине названия.
+        """
+        keys, entries = self._load()
+        query = query.casefold()
+        result = []
+        position = bisect_left(keys, query)
+        while (len(result) < limit and position < len(keys)
+               and keys[position].startswith(query)):
+            result.append(entries[position])
+            position += 1
+        for key, entry in zip(keys, entries):
+            if len(result) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                result.append(entry)
+        return result
+
+
+def words(text):
+    return WORD_RE.findall(text.casefold())
+
+
+def stem(word):
+    """Грубое отсечение окончания, чтобы "томаты" находило "томат"."""
+    return word[:-2] if len(word) > 5 else word
+
+
+class RecipeSearchIndex:
+    """
+    Инвертированный индекс рецептов в памяти процесса:
+    запасной полнотекстовый поиск для баз без PostgreSQL.
+    Перестраивается, когда меняется счетчик поколения рецептов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._generation = None
+        self._data = ([], [])
+
+    def _load(self):
+        generation = get_generation(GENERATION_KEY)
+        if generation == self._generation:
+            return self._data
+        with self._lock:
+            if generation != self._generation:
+                postings = defaultdict(dict)
+
+                def add(recipe_id, text, field):
+                    for word in words(text):
+                        scores = postings[word]
+                        scores[recipe_id] = (
+                            scores.get(recipe_id, 0) + SEARCH_WEIGHTS[field]
+                        )
+
+                for pk, name, text in Recipe.objects.values_list(
+                    'id', 'name', 'text',
+                ):
+                    add(pk, name, 'name')
+                    add(pk, text, 'text')
+                for pk, name in IngredientInRecipe.objects.values_list(
+                    'recipe_id', 'ingredient__name',
+                ):
+                    add(pk, name, 'ingredients')
+                keys = sorted(postings)
+                self._data = (keys, [postings[key] for key in keys])
+                self._generation = generation
+        return self._data
+
+    def search(self, query):
+        """
+        Id рецептов, содержащих все слова запроса (по началу слова),
+        от более релевантных к менее.
+        """
+        keys, postings = self._load()
+        result = None
+        for word in words(query):
+            prefix = stem(word)
+            scores = defaultdict(float)
+            position = bisect_left(keys, prefix)
+            while position < len(keys) and keys[position].startswith(prefix):
+                for pk, score in postings[position].items():
+                    scores[pk] = max(scores[pk], score)
+                position += 1
+            if result is None:
+                result = scores
+            else:
+                result = {
+                    pk: score + scores[pk]
+                    for pk, score in result.items() if pk in scores
+                }
+        if not result:
+            return []
+        return sorted(result, key=lambda pk: (-result[pk], -pk))
+
+
+def pantry_change_key(sequence):
+    return f'pantry:change:{sequence}'
+
+
+def record_pantry_change(recipe_id):
+    """Записывает в журнал изменение ингредиентов или тэгов рецепта."""
+    cache.set(
+        pantry_change_key(bump_generation(PANTRY_CHANGES_KEY)),
+        recipe_id,
+        PANTRY_CHANGE_TIMEOUT,
+    )
+
+
+class PantryIndex:
+    """
+    Инвертированный индекс "ингредиент -> рецепты" в памяти процесса
+    для подбора рецептов по имеющимся продуктам.
+    Изменения рецептов применяются по журналу в кэше только
+    для измененных рецептов; индекс строится заново при первом
+    обращении, смене счетчика поколения или потере записей журнала.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._generation = None
+        self._sequence = None
+        # id рецепта -> (id его ингредиентов, id его тэгов).
+        self._recipes = {}
+        # id ингредиента -> id рецептов с ним.
+        self._postings = {}
+
+    def _load(self):
+        generation = get_generation(PANTRY_GENERATION_KEY)
+        sequence = get_generation(PANTRY_CHANGES_KEY)
+        if (generation == self._generation
+                and sequence == self._sequence):
+            return
+        with self._lock:
+            if generation != self._generation:
+                self._rebuild()
+            elif sequence != self._sequence:
+                if not self._apply_changes(sequence):
+                    self._rebuild()
+            self._generation = generation
+            self._sequence = sequence
+
+    @staticmethod
+    def _read(recipe_ids=None):
+        recipes = Recipe.objects.all()
+        ingredients = IngredientInRecipe.objects.all()
+        tags = Recipe.tags.through.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(id__in=recipe_ids)
+            ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+            tags = tags.filter(recipe_id__in=recipe_ids)
+        data = {
+            pk: (set(), set())
+            for pk in recipes.values_list('id', flat=True)
+        }
+        for pk, ingredient_id in ingredients.values_list(
+            'recipe_id', 'ingredient_id',
+        ):
+            if pk in data:
+                data[pk][0].add(ingredient_id)
+        for pk, tag_id in tags.values_list('recipe_id', 'tag_id'):
+            if pk in data:
+                data[pk][1].add(tag_id)
+        return {
+            pk: (frozenset(ingredients), frozenset(tags))
+            for pk, (ingredients, tags) in data.items()
+        }
+
+    def _rebuild(self):
+        recipes = self._read()
+        postings = defaultdict(set)
+        for pk, (ingredients, _) in recipes.items():
+            for ingredient_id in ingredients:
+                postings[ingredient_id].add(pk)
+        self._recipes, self._postings = recipes, dict(postings)
+
+    def _apply_changes(self, sequence):
+        """
+        Применяет записи журнала после последней прочитанной.
+        False - если журнал сброшен или часть записей уже потеряна.
+        """
+        if (self._sequence is None or sequence < self._sequence
+                or sequence - self._sequence > PANTRY_CHANGES_LIMIT):
+            return False
+        keys = [
+            pantry_change_key(number)
+            for number in range(self._sequence + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return False
+        recipe_ids = set(changes.values())
+        recipes = self._read(recipe_ids)
+        touched = set()
+        for pk in recipe_ids:
+            for entry in (self._recipes.get(pk), recipes.get(pk)):
+                if entry is not None:
+                    touched |= entry[0]
+        # Множества заменяются новыми, а не меняются на месте:
+        # параллельные запросы в других потоках читают их без блокировки.
+        for ingredient_id in touched:
+            self._postings[ingredient_id] = {
+                pk for pk in self._postings.get(ingredient_id, ())
+                if pk not in recipe_ids
+            } | {
+                pk for pk in recipe_ids
+                if pk in recipes and ingredient_id in recipes[pk][0]
+            }
+        for pk in recipe_ids:
+            if pk in recipes:
+                self._recipes[pk] = recipes[pk]
+            else:
+                self._recipes.pop(pk, None)
+        return True
+
+    def search(self, ingredient_ids, tag_ids=None, max_missing=None):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов,
+        в виде (доля имеющихся ингредиентов, число недостающих, id):
+        от полностью покрытых к наименее покрытым.
+        tag_ids - рецепт должен иметь хотя бы один из этих тэгов.
+        """
+        self._load()
+        recipes, postings = self._recipes, self._postings
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        result = []
+        for pk, count in matched.items():
+            ingredients, tags = recipes.get(pk, ((), ()))
+            if not ingredients:
+                continue
+            if tag_ids is not None and not tags & tag_ids:
+                continue
+            missing = max(len(ingredients) - count, 0)
+            if max_missing is not None and missing > max_missing:
+                continue
+            result.append((count / len(ingredients), missing, pk))
+        result.sort(key=lambda row: (-row[0], row[1], -row[2]))
+        return result
+
+
+ingredient_index = IngredientIndex()
+recipe_search_index = RecipeSearchIndex()
+pantry_index = PantryIndex()
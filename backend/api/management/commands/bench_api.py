@@ -0,0 +1,365 @@
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from djoser.utils import encode_uid
+from rest_framework.authtoken.models import Token
+
+from api.authentication import local_tokens
+from api.management.commands.seed_benchmark import (PASSWORD,
+                                                    RECIPE_PREFIX,
+                                                    USER_PREFIX)
+from recipes.models import (FavouriteRecipe, Ingredient, Recipe,
+                            ShoppingCart, Tag)
+from users.models import ProjectUser, Subscribe
+
+BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+# Допустимое превышение базовой линии: запросы - абсолютное,
+# время и память - относительное с минимальным абсолютным запасом.
+THRESHOLDS = {
+    'queries': 0,
+    'time': 1.0,
+    'time_ms_slack': 10,
+    'memory': 0.5,
+    'memory_kb_slack': 128,
+}
+PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+# (название, метод, адрес, авторизация, тело запроса).
+ENDPOINTS = (
+    ('tags-list', 'get', '/api/tags/', False, None),
+    ('tags-detail', 'get', '/api/tags/{tag}/', False, None),
+    ('ingredients-list', 'get', '/api/ingredients/', False, None),
+    ('ingredients-search', 'get', '/api/ingredients/?name=то', False, None),
+    ('ingredients-detail', 'get', '/api/ingredients/{ingredient}/',
+     False, None),
+    ('recipes-list-anon', 'get', '/api/recipes/', False, None),
+    ('recipes-list', 'get', '/api/recipes/?limit=6', True, None),
+    ('recipes-list-filtered', 'get',
+     '/api/recipes/?tags={tag_slug}&is_favorited=1', True, None),
+    ('recipes-list-popular', 'get', '/api/recipes/?ordering=popular',
+     False, None),
+    ('recipes-search', 'get', '/api/recipes/?search=томат', False, None),
+    ('recipes-list-cursor', 'get', '/api/recipes/?cursor=', False, None),
+    ('recipes-detail-anon', 'get', '/api/recipes/{recipe}/', False, None),
+    ('recipes-detail', 'get', '/api/recipes/{recipe}/', True, None),
+    ('recipes-similar', 'get', '/api/recipes/{recipe}/similar/', False,
+     None),
+    ('recipes-by-ingredients', 'get', '/api/recipes/by-ingredients/?{pantry}',
+     False, None),
+    ('recipes-create', 'post', '/api/recipes/', True, 'recipe'),
+    ('recipes-update', 'patch', '/api/recipes/{own_recipe}/', True,
+     'recipe'),
+    ('recipes-delete', 'delete', '/api/recipes/{own_recipe}/', True, None),
+    ('recipes-favorite', 'post', '/api/recipes/{recipe}/favorite/',
+     True, None),
+    ('recipes-favorite-delete', 'delete',
+     '/api/recipes/{favorite}/favorite/', True, None),
+    ('recipes-shopping-cart', 'post', '/api/recipes/{recipe}/shopping_cart/',
+     True, None),
+    ('recipes-shopping-cart-delete', 'delete',
+     '/api/recipes/{in_cart}/shopping_cart/', True, None),
+    ('recipes-download-shopping-cart', 'get',
+     '/api/recipes/download_shopping_cart/', True, None),
+    ('feed-list', 'get', '/api/feed/', True, None),
+    ('users-list', 'get', '/api/users/', False, None),
+    ('users-detail', 'get', '/api/users/{author}/', True, None),
+    ('users-me', 'get', '/api/users/me/', True, None),
+    ('users-create', 'post', '/api/users/', False, 'user'),
+    ('users-update', 'put', '/api/users/{user_id}/', True, 'profile'),
+    ('users-partial-update', 'patch', '/api/users/{user_id}/', True,
+     'profile'),
+    ('users-delete', 'delete', '/api/users/{user_id}/', True,
+     'current_password'),
+    ('users-set-password', 'post', '/api/users/set_password/', True,
+     'password'),
+    ('users-reset-password-confirm', 'post',
+     '/api/users/reset_password_confirm/', False, 'reset_password'),
+    # Пользователи создаются активными, а письма активации выключены:
+    # замеряется отказ (403 и 400).
+    ('users-activation', 'post', '/api/users/activation/', False, 'uid'),
+    ('users-resend-activation', 'post', '/api/users/resend_activation/',
+     False, 'email'),
+    ('users-subscriptions', 'get', '/api/users/subscriptions/', True, None),
+    ('users-subscribe', 'post', '/api/users/{author}/subscribe/', True,
+     None),
+    ('users-subscribe-delete', 'delete', '/api/users/{followed}/subscribe/',
+     True, None),
+    ('token-login', 'post', '/api/auth/token/login/', False, 'login'),
+    ('token-logout', 'post', '/api/auth/token/logout/', True, None),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет все эндпоинты API через тестовый клиент на данных '
+        'seed_benchmark, замеряет число запросов к БД, время и память '
+        'и сравнивает результаты с базовой линией. Не замеряются: '
+        'PUT, PATCH и DELETE /api/users/me/ - в проекте /me/ отдает '
+        'только GET (профиль правится через /api/users/{id}/); '
+        'reset_password и reset_username - в настройках DJOSER нет '
+        'адресов подтверждения для писем; set_username '
+        'и reset_username_confirm - djoser 2.1 при LOGIN_FIELD = email '
+        'ищет поле new_username. Эти эндпоинты отвечают 500.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', help='Сохранить результаты в JSON.')
+        parser.add_argument('--baseline', default=str(BASELINE))
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Записать результаты как новую базовую линию.',
+        )
+        parser.add_argument('--only', help='Подстрока названия эндпоинта.')
+
+    def handle(self, *args, repeat, output, baseline, update_baseline,
+               only, **options):
+        context = self.get_context()
+        client = Client(HTTP_HOST='localhost')
+        token = Token.objects.get_or_create(user=context['user'])[0]
+        results = {}
+        with TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, IMAGE_RENDITIONS_ASYNC=False,
+        ):
+            for name, method, path, auth, body in ENDPOINTS:
+                if only and only not in name:
+                    continue
+                headers = (
+                    {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+                    if auth else {}
+                )
+                results[name] = self.measure(
+                    client, method, path.format(**context), headers,
+                    self.get_body(body, context), repeat,
+                )
+                self.stdout.write(self.format_result(name, results[name]))
+        meta = {'vendor': connection.vendor, 'repeat': repeat}
+        if output:
+            self.write(output, {'meta': meta, 'results': results})
+        baseline = Path(baseline)
+        if update_baseline:
+            self.write(baseline, {'meta': meta, 'thresholds': THRESHOLDS,
+                                  'results': results})
+            self.stdout.write(f'Базовая линия сохранена в {baseline}')
+        elif baseline.exists():
+            self.compare(results, json.loads(baseline.read_text('utf-8')))
+
+    def get_context(self):
+        """Id объектов для адресов эндпоинтов."""
+        user = ProjectUser.objects.filter(
+            username__startswith=USER_PREFIX,
+            recipes_count__gt=0,
+            subscriber__isnull=False,
+            favorite_autor__isnull=False,
+            shopping_user__isnull=False,
+        ).order_by('id').first()
+        if user is None:
+            raise CommandError(
+                'Нет данных для замеров: выполните manage.py seed_benchmark.'
+            )
+        followed = Subscribe.objects.filter(user=user).values_list(
+            'author_id', flat=True
+        )
+        recipe = Recipe.objects.filter(
+            name__startswith=RECIPE_PREFIX,
+        ).exclude(author=user).exclude(
+            favorites_recipe__user=user,
+        ).exclude(shopping_cart__user=user).order_by(
+            '-favorites_count', 'id'
+        ).first()
+        tag = Tag.objects.filter(recipe__isnull=False).order_by('id').first()
+        ingredients = recipe.recipes.values_list('ingredient_id', flat=True)
+        pantry = Ingredient.objects.order_by('id').values_list(
+            'id', flat=True
+        )[:20]
+        return {
+            'user': user,
+            'recipe': recipe.id,
+            'own_recipe': user.recipes.order_by('id').first().id,
+            'favorite': FavouriteRecipe.objects.filter(
+                user=user
+            ).order_by('id').first().recipe_id,
+            'in_cart': ShoppingCart.objects.filter(
+                user=user
+            ).order_by('id').first().recipe_id,
+            'author': ProjectUser.objects.filter(
+                username__startswith=USER_PREFIX, recipes_count__gt=0,
+            ).exclude(pk=user.pk).exclude(pk__in=followed).order_by(
+                'id'
+            ).first().id,
+            'followed': followed.order_by('author_id').first(),
+            'tag': tag.id,
+            'tag_slug': tag.slug,
+            'ingredient': ingredients[0],
+            'ingredients': list(ingredients[:5]),
+            'pantry': '&'.join(f'ingredients={pk}' for pk in pantry),
+            'email': user.email,
+            'user_id': user.id,
+            'uid': encode_uid(user.pk),
+            'token': default_token_generator.make_token(user),
+        }
+
+    @staticmethod
+    def get_body(body, context):
+        if body == 'recipe':
+            return {
+                'name': f'{RECIPE_PREFIX} замер',
+                'text': 'Описание рецепта для замера.',
+                'cooking_time': 30,
+                'image': PNG,
+                'tags': [context['tag']],
+                'ingredients': [
+                    {'id': pk, 'amount': 100} for pk in context['ingredients']
+                ],
+            }
+        if body == 'user':
+            return {
+                'email': 'bench_new@example.com',
+                'username': 'bench_new',
+                'first_name': 'Имя',
+                'last_name': 'Фамилия',
+                'password': 'Secret-password-123',
+            }
+        if body == 'password':
+            return {
+                'current_password': PASSWORD,
+                'new_password': 'Another-password-456',
+            }
+        if body == 'login':
+            return {'email': context['email'], 'password': PASSWORD}
+        if body == 'profile':
+            return {
+                'email': context['email'],
+                'username': context['user'].username,
+                'first_name': 'Новое имя',
+                'last_name': 'Новая фамилия',
+            }
+        if body == 'current_password':
+            return {'current_password': PASSWORD}
+        if body == 'email':
+            return {'email': context['email']}
+        if body == 'uid':
+            return {'uid': context['uid'], 'token': context['token']}
+        if body == 'reset_password':
+            return {
+                'uid': context['uid'], 'token': context['token'],
+                'new_password': 'Another-password-456',
+            }
+        return None
+
+    def request(self, client, method, path, headers, body):
+        """Запрос в транзакции, которая откатывается: данные не меняются."""
+        # Замеряем путь без кэша: сбрасываем общий кэш и кэш токенов.
+        cache.clear()
+        local_tokens.clear()
+        with transaction.atomic():
+            response = getattr(client, method)(
+                path, data=body, content_type='application/json', **headers,
+            ) if body is not None else getattr(client, method)(
+                path, **headers,
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        return response
+
+    def measure(self, client, method, path, headers, body, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request(client, method, path, headers, body)
+        # Журнал запросов очищается в начале каждого следующего запроса.
+        query_count = len(queries)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            self.request(client, method, path, headers, body)
+            timings.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        try:
+            self.request(client, method, path, headers, body)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'status': response.status_code,
+            'queries': query_count,
+            'time_ms': round(median(timings), 2),
+            'memory_kb': round(peak / 1024, 1),
+        }
+
+    @staticmethod
+    def format_result(name, result):
+        return (
+            f'{name:<32} {result["status"]:>4} '
+            f'{result["queries"]:>4} запр. '
+            f'{result["time_ms"]:>9.2f} мс '
+            f'{result["memory_kb"]:>9.1f} КБ'
+        )
+
+    @staticmethod
+    def write(path, data):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps(data, ensure_ascii=False, indent=2) + '\n', 'utf-8',
+        )
+
+    def compare(self, results, baseline):
+        vendor = baseline.get('meta', {}).get('vendor')
+        if vendor and vendor != connection.vendor:
+            self.stdout.write(self.style.WARNING(
+                f'Базовая линия снята на {vendor}, а замеры - на '
+                f'{connection.vendor}: сравнение времени неточно.'
+            ))
+        thresholds = {**THRESHOLDS, **baseline.get('thresholds', {})}
+        regressions = []
+        for name, result in results.items():
+            expected = baseline['results'].get(name)
+            if expected is None:
+                continue
+            if result['status'] != expected['status']:
+                regressions.append(
+                    f'{name}: статус {result["status"]}, '
+                    f'ожидался {expected["status"]}'
+                )
+            if result['queries'] > expected['queries'] + thresholds['queries']:
+                regressions.append(
+                    f'{name}: запросов {result["queries"]}, '
+                    f'в базовой линии {expected["queries"]}'
+                )
+            if result['time_ms'] > max(
+                expected['time_ms'] * (1 + thresholds['time']),
+                expected['time_ms'] + thresholds['time_ms_slack'],
+            ):
+                regressions.append(
+                    f'{name}: {result["time_ms"]} мс, '
+                    f'в базовой линии {expected["time_ms"]} мс'
+                )
+            if result['memory_kb'] > max(
+                expected['memory_kb'] * (1 + thresholds['memory']),
+                expected['memory_kb'] + thresholds['memory_kb_slack'],
+            ):
+                regressions.append(
+                    f'{name}: {result["memory_kb"]} КБ, '
+                    f'в базовой линии {expected["memory_kb"]} КБ'
+                )
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Результаты в пределах базовой линии.'
+        ))
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагружает запущенный сервер (WSGI или ASGI) параллельными '
+        'GET-запросами и выводит пропускную способность на ядро. '
+        'Запустите для каждого режима и сравните результаты.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', action='append', required=True,
+            help='Адрес эндпоинта (можно указать несколько раз).',
+        )
+        parser.add_argument(
+            '--concurrency', default='1,8,32,128',
+            help='Уровни параллельности через запятую.',
+        )
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument(
+            '--cores', type=int, default=os.cpu_count(),
+            help='Число ядер, выделенных серверу.',
+        )
+        parser.add_argument('--token', help='Токен для авторизации.')
+        parser.add_argument('--output', help='Сохранить результаты в JSON.')
+
+    def handle(self, *args, url, concurrency, duration, cores, token,
+               output, **options):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        results = []
+        for level in map(int, concurrency.split(',')):
+            result = self.run_level(url, level, duration, headers)
+            result['rps_per_core'] = round(result['rps'] / cores, 1)
+            results.append(result)
+            self.stdout.write(
+                f'{level:>5} потоков: {result["rps"]:>8.1f} rps, '
+                f'{result["rps_per_core"]:>7.1f} rps/ядро, '
+                f'p50 {result["p50_ms"]:.1f} мс, '
+                f'p99 {result["p99_ms"]:.1f} мс, '
+                f'ошибок {result["errors"]}'
+            )
+        if output:
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    def run_level(self, urls, level, duration, headers):
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def worker(number):
+            nonlocal errors
+            session = requests.Session()
+            own = []
+            own_errors = 0
+            index = number
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    response = session.get(
+                        urls[index % len(urls)], headers=headers,
+                    )
+                    if response.status_code >= 400:
+                        own_errors += 1
+                except requests.RequestException:
+                    own_errors += 1
+                own.append(time.monotonic() - started)
+                index += 1
+            with lock:
+                latencies.extend(own)
+                errors += own_errors
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=level) as executor:
+            list(executor.map(worker, range(level)))
+        elapsed = time.monotonic() - started
+        percentiles = (
+            quantiles(latencies, n=100) if len(latencies) > 1
+            else [0] * 99
+        )
+        return {
+            'concurrency': level,
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentiles[49] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+        }
@@ -0,0 +1,102 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет запросы через WSGI-обработчик в несколько потоков '
+        'с CONN_MAX_AGE=0 и с текущей настройкой и сравнивает число '
+        'открытых соединений с БД и время ответа.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default='/api/users/',
+            help='Эндпоинт без кэша для анонимов, чтобы запросы шли в БД.',
+        )
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--max-age', type=int,
+            default=settings.DATABASES['default'].get('CONN_MAX_AGE') or 60,
+            help='CONN_MAX_AGE для сравнения с закрытием после запроса.',
+        )
+
+    def handle(self, *args, path, requests, threads, max_age, **options):
+        handler = WSGIHandler()
+        for conn_max_age in (0, max_age):
+            opened, elapsed, errors = self.run(
+                handler, path, requests, threads, conn_max_age,
+            )
+            self.stdout.write(
+                f'CONN_MAX_AGE={conn_max_age:<4} '
+                f'соединений открыто: {opened:>5}, '
+                f'{elapsed / requests * 1000:.2f} мс/запрос, '
+                f'{requests / elapsed:.1f} rps, ошибок {errors}'
+            )
+
+    def run(self, handler, path, requests, threads, conn_max_age):
+        connections.close_all()
+        opened = 0
+        errors = 0
+        lock = threading.Lock()
+
+        def count(**kwargs):
+            nonlocal opened
+            with lock:
+                opened += 1
+
+        def worker(number):
+            nonlocal errors
+            connections['default'].settings_dict['CONN_MAX_AGE'] = (
+                conn_max_age
+            )
+            own_errors = 0
+            for _ in range(number, requests, threads):
+                if self.request(handler, path) >= 400:
+                    own_errors += 1
+            connections.close_all()
+            with lock:
+                errors += own_errors
+
+        connection_created.connect(count)
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(worker, range(threads)))
+        finally:
+            connection_created.disconnect(count)
+        return opened, time.monotonic() - started, errors
+
+    @staticmethod
+    def request(handler, path):
+        url = urlsplit(path)
+        status = []
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': 'localhost',
+            'wsgi.input': BytesIO(),
+            'wsgi.url_scheme': 'http',
+        }
+        response = handler(
+            environ, lambda code, headers: status.append(int(code[:3])),
+        )
+        for _ in response:
+            pass
+        # Как и WSGI-сервер, закрываем ответ: Django закрывает
+        # устаревшие соединения по сигналу request_finished.
+        response.close()
+        return status[0]
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.recommendations import build_similar_recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит таблицу похожих рецептов по косинусному сходству '
+        'совместного добавления в избранное. Запускается по расписанию.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=20,
+            help='Сколько похожих рецептов хранить для каждого.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=100_000,
+            help='Строк избранного и похожих рецептов за одну порцию.',
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=1000,
+            help='Рецептов в блоке при перемножении матриц.',
+        )
+
+    def handle(self, *args, top_k, chunk_size, block_size, **options):
+        created = build_similar_recipes(top_k, chunk_size, block_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено пар похожих рецептов: {created}'
+        ))
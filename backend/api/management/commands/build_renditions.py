@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.images import build_renditions, needs_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные версии изображений для уже созданных рецептов.'
+
+    def handle(self, *args, **options):
+        built = 0
+        for recipe in Recipe.objects.only(
+            'image', 'image_renditions',
+        ).iterator():
+            if needs_renditions(recipe):
+                build_renditions(recipe.id)
+                built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {built}.'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import recount
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики избранного, списков покупок, '
+        'рецептов и подписчиков автора, если они разошлись с данными.'
+    )
+
+    def handle(self, *args, **options):
+        for counter, repaired in recount().items():
+            self.stdout.write(f'{counter}: исправлено {repaired}')
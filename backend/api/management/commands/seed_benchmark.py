@@ -0,0 +1,198 @@
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import (GENERATION_KEY, INGREDIENTS_GENERATION_KEY,
+                       PANTRY_GENERATION_KEY, TAGS_GENERATION_KEY,
+                       bump_generation)
+from api.counters import recount
+from api.recommendations import build_similar_recipes
+from api.search import update_search_vectors
+from recipes.models import (FavouriteRecipe, FeedEntry, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart, Tag)
+from users.models import ProjectUser, Subscribe
+
+USER_PREFIX = 'bench_'
+RECIPE_PREFIX = 'Бенчмарк'
+PASSWORD = 'bench-password'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'bench-breakfast'),
+    ('Обед', '#49B64E', 'bench-lunch'),
+    ('Ужин', '#8775D2', 'bench-dinner'),
+    ('Десерт', '#F2C94C', 'bench-dessert'),
+    ('Выпечка', '#A0522D', 'bench-bakery'),
+    ('Постное', '#2F80ED', 'bench-lenten'),
+)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+WORDS = (
+    'томат', 'свекла', 'картофель', 'курица', 'говядина', 'рис', 'гречка',
+    'сыр', 'молоко', 'яйцо', 'мука', 'сахар', 'лук', 'чеснок', 'морковь',
+    'капуста', 'грибы', 'перец', 'укроп', 'сметана', 'масло', 'творог',
+)
+
+
+def zipf_weights(count, exponent=1.0):
+    """Веса "длинного хвоста": несколько популярных и много редких."""
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def sample(rng, population, weights, count):
+    """До count разных элементов с учетом весов."""
+    chosen = set()
+    for _ in range(count * 3):
+        if len(chosen) >= count:
+            break
+        chosen.add(rng.choices(population, weights)[0])
+    return chosen
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу детерминированным синтетическим набором данных '
+        'для bench_api: пользователи, рецепты, тэги, ингредиенты, '
+        'избранное, списки покупок и подписки с неравномерным '
+        'распределением популярности.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--flush', action='store_true',
+            help='Удалить данные предыдущего запуска.',
+        )
+
+    def handle(self, *args, users, recipes, ingredients, seed, flush,
+               **options):
+        rng = random.Random(seed)
+        with transaction.atomic():
+            if flush:
+                self.flush()
+            self.seed(rng, users, recipes, ingredients)
+        # bulk_create не отправляет сигналы: пересчитываем производные
+        # данные и сбрасываем кэши явно.
+        recount()
+        update_search_vectors(
+            Recipe.objects.filter(name__startswith=RECIPE_PREFIX)
+        )
+        build_similar_recipes()
+        for key in (GENERATION_KEY, INGREDIENTS_GENERATION_KEY,
+                    TAGS_GENERATION_KEY, PANTRY_GENERATION_KEY):
+            bump_generation(key)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {users}, рецептов: {recipes}, '
+            f'ингредиентов: {ingredients}. Пароль: {PASSWORD}'
+        ))
+
+    def flush(self):
+        Recipe.objects.filter(name__startswith=RECIPE_PREFIX).delete()
+        ProjectUser.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def seed(self, rng, user_count, recipe_count, ingredient_count):
+        password = make_password(PASSWORD)
+        ProjectUser.objects.bulk_create([
+            ProjectUser(
+                username=f'{USER_PREFIX}{number}',
+                email=f'{USER_PREFIX}{number}@example.com',
+                first_name=f'Имя{number}',
+                last_name=f'Фамилия{number}',
+                password=password,
+            )
+            for number in range(user_count)
+        ])
+        users = list(ProjectUser.objects.filter(
+            username__startswith=USER_PREFIX
+        ).order_by('id'))
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color},
+            )
+        tags = list(Tag.objects.filter(slug__in=[tag[2] for tag in TAGS]))
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(
+                    name=f'{rng.choice(WORDS)} {number}',
+                    measurement_unit=rng.choice(UNITS),
+                )
+                for number in range(ingredient_count)
+            ],
+            ignore_conflicts=True,
+        )
+        ingredients = list(Ingredient.objects.order_by('id'))
+
+        author_weights = zipf_weights(len(users), 0.8)
+        Recipe.objects.bulk_create([
+            Recipe(
+                name=f'{RECIPE_PREFIX} {number} {rng.choice(WORDS)}',
+                author=rng.choices(users, author_weights)[0],
+                text=' '.join(rng.choices(WORDS, k=rng.randint(10, 60))),
+                cooking_time=rng.randint(5, 180),
+            )
+            for number in range(recipe_count)
+        ], batch_size=1000)
+        recipes = list(Recipe.objects.filter(
+            name__startswith=RECIPE_PREFIX
+        ).order_by('id').only('id', 'author_id'))
+
+        ingredient_weights = zipf_weights(len(ingredients), 0.7)
+        tag_weights = zipf_weights(len(tags), 0.5)
+        rows = []
+        recipe_tags = []
+        for recipe in recipes:
+            for ingredient in sample(
+                rng, ingredients, ingredient_weights, rng.randint(3, 12)
+            ):
+                rows.append(IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient=ingredient,
+                    amount=rng.randint(1, settings.MAX_INGREDIENT_VALUE),
+                ))
+            for tag in sample(rng, tags, tag_weights, rng.randint(1, 3)):
+                recipe_tags.append(Recipe.tags.through(
+                    recipe_id=recipe.id, tag_id=tag.id,
+                ))
+        IngredientInRecipe.objects.bulk_create(rows, batch_size=1000)
+        Recipe.tags.through.objects.bulk_create(recipe_tags, batch_size=1000)
+
+        recipe_weights = zipf_weights(len(recipes))
+        favorites = []
+        carts = []
+        subscriptions = []
+        for user in users:
+            for recipe in sample(
+                rng, recipes, recipe_weights, rng.randint(0, 20)
+            ):
+                favorites.append(FavouriteRecipe(user=user, recipe=recipe))
+            for recipe in sample(
+                rng, recipes, recipe_weights, rng.randint(0, 6)
+            ):
+                carts.append(ShoppingCart(user=user, recipe=recipe))
+            for author in sample(
+                rng, users, author_weights, rng.randint(0, 15)
+            ):
+                if author != user:
+                    subscriptions.append(Subscribe(user=user, author=author))
+        FavouriteRecipe.objects.bulk_create(favorites, batch_size=1000)
+        ShoppingCart.objects.bulk_create(carts, batch_size=1000)
+        Subscribe.objects.bulk_create(subscriptions, batch_size=1000)
+
+        by_author = defaultdict(list)
+        for recipe in reversed(recipes):
+            by_author[recipe.author_id].append(recipe.id)
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=subscription.user_id, recipe_id=recipe_id)
+                for subscription in subscriptions
+                for recipe_id in by_author[subscription.author_id][
+                    :settings.FEED_BACKFILL
+                ]
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Метрики процессов gunicorn складываются в общий каталог
+# PROMETHEUS_MULTIPROC_DIR и объединяются при выгрузке.
+MULTIPROC_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds',
+    'Время обработки запроса.',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'api_db_queries_per_request',
+    'Число SQL-запросов на один запрос к API.',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf')),
+)
+DB_DURATION = Histogram(
+    'api_db_duration_seconds',
+    'Суммарное время SQL-запросов на один запрос к API.',
+    ['route'],
+)
+CACHE_REQUESTS = Counter(
+    'api_cache_requests_total',
+    'Обращения к кэшам по результату: hit или miss.',
+    ['cache', 'result'],
+)
+IN_PROGRESS = Gauge(
+    'api_requests_in_progress',
+    'Запросы, обрабатываемые в данный момент.',
+    multiprocess_mode='livesum',
+)
+CAPACITY = Gauge(
+    'api_worker_capacity',
+    'Сколько запросов процессы могут обрабатывать одновременно.',
+    multiprocess_mode='livesum',
+)
+
+_db_usage = ContextVar('db_usage', default=None)
+
+
+def record_cache(name, hit):
+    CACHE_REQUESTS.labels(name, 'hit' if hit else 'miss').inc()
+
+
+def count_query(execute, sql, params, many, context):
+    usage = _db_usage.get()
+    if usage is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        usage[0] += 1
+        usage[1] += time.perf_counter() - started
+
+
+def install_query_counter(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def get_route(request):
+    """Имя маршрута (recipes-list, feed-list); без имени - шаблон адреса."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route or 'unnamed'
+
+
+class MetricsMiddleware:
+    """
+    Метрики запросов для Prometheus: время ответа по маршрутам,
+    число и время SQL-запросов, загрузка процессов.
+    Работает и в WSGI, и в ASGI: под ASGI запросы не сериализуются
+    через async_to_sync. Выключается настройкой METRICS_ENABLED.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            # Так Django 3.2 узнает, что экземпляр вызывается через await.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(install_query_counter)
+        for connection in connections.all():
+            install_query_counter(connection)
+        CAPACITY.set(
+            settings.ASYNC_DB_THREADS if settings.ASYNC_VIEWS else 1
+        )
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        usage, token, started = self.start()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self.stop(request, status, usage, token, started)
+
+    async def __acall__(self, request):
+        # Запросы к БД идут в потоках sync_to_async, которые получают
+        # копию контекста: usage в ней тот же самый список.
+        usage, token, started = self.start()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            self.stop(request, status, usage, token, started)
+
+    def start(self):
+        usage = [0, 0.0]
+        token = _db_usage.set(usage)
+        IN_PROGRESS.inc()
+        return usage, token, time.perf_counter()
+
+    def stop(self, request, status, usage, token, started):
+        duration = time.perf_counter() - started
+        IN_PROGRESS.dec()
+        _db_usage.reset(token)
+        route = get_route(request)
+        REQUEST_DURATION.labels(
+            route, request.method, status
+        ).observe(duration)
+        DB_QUERIES.labels(route).observe(usage[0])
+        DB_DURATION.labels(route).observe(usage[1])
+
+
+def metrics(request):
+    """Метрики в текстовом формате Prometheus."""
+    if os.getenv(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST,
+    )
@@ -1,9 +1,61 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ProjectCursorPagination(CursorPagination):
+    """Постраничный вывод по курсору: без COUNT(*) и OFFSET."""
+    ordering = '-id'
+    page_size_query_param = 'limit'
 
 
 class ProjectPagination(PageNumberPagination):
+    """
+    Постраничный вывод по номеру страницы, а при наличии
+    параметра ?cursor= - по курсору (ProjectCursorPagination).
+    Курсор задает свою сортировку, поэтому с другой сортировкой
+    (поиск по релевантности, ?ordering=popular) он не принимается.
+    """
+    page_size_query_param = "limit"
+    cursor_pagination_class = ProjectCursorPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_paginator = self.cursor_pagination_class()
+        if cursor_paginator.cursor_query_param in request.query_params:
+            ordering = tuple(queryset.query.order_by)
+            if ordering and ordering != (cursor_paginator.ordering,):
+                raise ValidationError({
+                    cursor_paginator.cursor_query_param: (
+                        'Курсор нельзя сочетать с поиском '
+                        'и сортировкой по популярности.'
+                    ),
+                })
+            self.cursor_paginator = cursor_paginator
+            return cursor_paginator.paginate_queryset(
+                queryset, request, view,
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class PantryPagination(PageNumberPagination):
+    """
+    Рецепты из индекса кладовой - список, а не QuerySet:
+    только по номеру страницы, параметр ?cursor= не учитывается.
+    """
     page_size_query_param = "limit"
 
 
+class FeedPagination(ProjectCursorPagination):
+    """Курсор по id рецепта в ленте (диапазон по индексу ленты)."""
+    ordering = '-recipe_id'
+
+
 class SubscribePagination(PageNumberPagination):
     page_size_query_param = "recipes_limit"
@@ -0,0 +1,253 @@
+import base64
+import binascii
+import json
+import re
+from tempfile import SpooledTemporaryFile
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+CHUNK_SIZE = 64 * 1024
+DATA_URI_PREFIX = b'data:'
+MAX_HEADER_SIZE = 256
+# Экранирование в строке JSON: \uXXXX или один символ.
+ESCAPE_RE = re.compile(rb'\\(u[0-9a-fA-F]{4}|[^u])')
+# Подряд идущие \uXXXX: суррогатные пары раскрываются вместе.
+UNICODE_ESCAPES_RE = re.compile(rb'(?:\\u[0-9a-fA-F]{4})+')
+ESCAPES = {
+    b'"': b'"', b'\\': b'\\', b'/': b'/', b'b': b'\b', b'f': b'\f',
+    b'n': b'\n', b'r': b'\r', b't': b'\t',
+}
+# Переводы строк и пробелы в base64 не значимы и отбрасываются.
+BASE64_WHITESPACE = b' \t\r\n'
+
+
+def unescape(data):
+    """
+    Раскрывает экранирование JSON в части строки. Возвращает
+    раскрытые данные и незавершенное экранирование в конце части,
+    которое нужно дополнить следующей частью.
+    """
+    result = bytearray()
+    pos = 0
+    while True:
+        index = data.find(b'\\', pos)
+        if index == -1:
+            result += data[pos:]
+            return bytes(result), b''
+        result += data[pos:index]
+        match = ESCAPE_RE.match(data, index)
+        if match is None:
+            if len(data) - index < len(b'\\u0000'):
+                return bytes(result), data[index:]
+            raise ParseError('JSON parse error - неверное экранирование.')
+        escape = match.group(1)
+        if escape in ESCAPES:
+            result += ESCAPES[escape]
+        elif escape.startswith(b'u'):
+            match = UNICODE_ESCAPES_RE.match(data, index)
+            escapes = match.group()
+            carry = b''
+            if (len(data) - match.end() < len(b'\\u0000')
+                    and 0xD800 <= int(escapes[-4:], 16) <= 0xDBFF):
+                # Старшая половина пары в конце части: младшая - в следующей.
+                escapes = escapes[:-6]
+                carry = data[match.end() - 6:]
+            try:
+                # Одиночная половина суррогатной пары не кодируется в UTF-8.
+                result += json.loads(b'"' + escapes + b'"').encode()
+            except ValueError:
+                raise ParseError('JSON parse error - неверное экранирование.')
+            if carry:
+                return bytes(result), carry
+        else:
+            raise ParseError('JSON parse error - неверное экранирование.')
+        pos = match.end()
+
+
+class _BufferedReader:
+    """Чтение потока запроса частями с поиском разделителя."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+        self.pos = 0
+        self.found = False
+
+    def _fill(self):
+        data = self.stream.read(CHUNK_SIZE)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def startswith(self, prefix):
+        while len(self.buffer) - self.pos < len(prefix):
+            if not self._fill():
+                break
+        return self.buffer.startswith(prefix, self.pos)
+
+    def peek(self):
+        """Следующий байт без чтения (b'' в конце потока)."""
+        if self.pos >= len(self.buffer) and not self._fill():
+            return b''
+        return self.buffer[self.pos:self.pos + 1]
+
+    def iter_until(self, delimiter):
+        """
+        Отдает данные частями до разделителя, сам разделитель пропускается.
+        После обхода self.found показывает, был ли найден разделитель.
+        """
+        self.found = False
+        while True:
+            index = self.buffer.find(delimiter, self.pos)
+            if index != -1:
+                piece = self.buffer[self.pos:index]
+                self.pos = index + 1
+                self.found = True
+                yield piece
+                return
+            piece = self.buffer[self.pos:]
+            self.buffer = b''
+            self.pos = 0
+            if piece:
+                yield piece
+            if not self._fill():
+                return
+
+
+class Base64JSONParser(JSONParser):
+    """
+    JSON-парсер, который декодирует строки вида "data:...;base64,..."
+    по частям во временный файл, не держа в памяти весь запрос.
+    Остальная часть документа разбирается обычным json.loads,
+    а на месте изображений в данных оказываются файлы.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        reader = _BufferedReader(stream)
+        self.skeleton = bytearray()
+        self.uploads = {}
+        token = uuid4().hex
+        while True:
+            for piece in reader.iter_until(b'"'):
+                self._append(piece)
+            if not reader.found:
+                break
+            self._append(b'"')
+            if reader.startswith(DATA_URI_PREFIX):
+                header = self._read_header(reader)
+                if header is not None:
+                    name = f'__upload_{token}_{len(self.uploads)}__'
+                    self.uploads[name] = self._decode(reader, header)
+                    self._append(name.encode() + b'"')
+            else:
+                self._copy_string(reader)
+        try:
+            data = json.loads(self.skeleton.decode(encoding))
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+        return self._substitute(data)
+
+    def _append(self, data):
+        if (len(self.skeleton) + len(data)
+                > settings.DATA_UPLOAD_MAX_MEMORY_SIZE):
+            raise ParseError('Слишком большой запрос.')
+        self.skeleton += data
+
+    def _read_header(self, reader):
+        """
+        Читает заголовок data URI до запятой. Для строк без base64
+        копирует их в документ как есть и возвращает None.
+        """
+        header = bytearray()
+        while True:
+            byte = reader.peek()
+            if byte == b',' and header.endswith(b';base64'):
+                reader.pos += 1
+                return header.decode('ascii', 'replace')
+            if reader.startswith(b'\\/'):
+                # Экранированный слеш "\/" в типе изображения.
+                reader.pos += 2
+                header += b'/'
+                continue
+            if (not byte or byte in b',"\\'
+                    or len(header) >= MAX_HEADER_SIZE):
+                self._append(header)
+                self._copy_string(reader)
+                return None
+            reader.pos += 1
+            header += byte
+
+    def _copy_string(self, reader):
+        """Копирует остаток JSON-строки вместе с закрывающей кавычкой."""
+        while True:
+            # Число обратных слешей перед кавычкой: нечетное - кавычка
+            # экранирована и строка продолжается.
+            backslashes = 0
+            for piece in reader.iter_until(b'"'):
+                self._append(piece)
+                stripped = len(piece.rstrip(b'\\'))
+                if stripped:
+                    backslashes = len(piece) - stripped
+                else:
+                    backslashes += len(piece)
+            if not reader.found:
+                raise ParseError('JSON parse error - незакрытая строка.')
+            self._append(b'"')
+            if backslashes % 2 == 0:
+                return
+
+    def _decode(self, reader, header):
+        file = SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_SIZE)
+        pending = b''
+        escape = b''
+        size = 0
+        for piece in reader.iter_until(b'"'):
+            data, escape = unescape(escape + piece)
+            pending += data.translate(None, BASE64_WHITESPACE)
+            usable = len(pending) // 4 * 4
+            size += self._write(file, pending[:usable])
+            pending = pending[usable:]
+        if not reader.found:
+            raise ParseError('JSON parse error - незакрытая строка.')
+        if escape:
+            # Экранированная кавычка или оборванное экранирование.
+            raise ParseError('Изображение закодировано некорректно.')
+        size += self._write(file, pending)
+        file.seek(0)
+        content_type = header[len('data:'):-len(';base64')] or None
+        return UploadedFile(
+            file=file, name='upload', content_type=content_type, size=size,
+        )
+
+    def _write(self, file, data):
+        if not data:
+            return 0
+        try:
+            decoded = base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError):
+            raise ParseError('Изображение закодировано некорректно.')
+        if file.tell() + len(decoded) > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise ParseError(
+                'Размер изображения превышает '
+                f'{settings.MAX_IMAGE_UPLOAD_SIZE} байт.'
+            )
+        file.write(decoded)
+        return len(decoded)
+
+    def _substitute(self, data):
+        if isinstance(data, dict):
+            return {key: self._substitute(value)
+                    for key, value in data.items()}
+        if isinstance(data, list):
+            return [self._substitute(value) for value in data]
+        if isinstance(data, str) and data in self.uploads:
+            return self.uploads[data]
+        return data
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+import tracemalloc
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+from api.fields import RecipeImageField
+
+logger = logging.getLogger(__name__)
+
+_profile = ContextVar('request_profile', default=None)
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+IN_LIST_RE = re.compile(r'IN \((?:\s*(?:%s|\?)\s*,?)+\)')
+
+
+def fingerprint(sql):
+    """SQL без литералов и с IN (...) любой длины - для поиска N+1."""
+    return IN_LIST_RE.sub('IN (...)', LITERAL_RE.sub('?', sql))
+
+
+class RequestProfile:
+    """Замеры одного запроса: SQL, сериализация, валидация, память."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.timings = Counter()
+        self.depth = Counter()
+
+    def record_query(self, sql, duration):
+        self.queries[fingerprint(sql)] += 1
+        self.db_time += duration
+
+    def duplicates(self):
+        return {
+            sql: count for sql, count in self.queries.most_common()
+            if count >= settings.PROFILING_DUPLICATE_THRESHOLD
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def timed(name, method):
+    """
+    Обертка метода, время которого попадает в замер под именем name.
+    Вложенные вызовы (сериализатор внутри сериализатора)
+    учитываются один раз - во внешнем вызове.
+    """
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        profile = _profile.get()
+        if profile is None or profile.depth[name]:
+            return method(*args, **kwargs)
+        profile.depth[name] += 1
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            profile.timings[name] += time.perf_counter() - started
+            profile.depth[name] -= 1
+
+    wrapper.profiled = True
+    return wrapper
+
+
+# Замеряемые методы: имя в Server-Timing -> (класс, метод).
+TIMED_METHODS = {
+    'serialize': (
+        (serializers.Serializer, 'to_representation'),
+        (serializers.ListSerializer, 'to_representation'),
+    ),
+    'validate': (
+        (serializers.Serializer, 'run_validation'),
+        (serializers.ListSerializer, 'run_validation'),
+    ),
+    'image': ((RecipeImageField, 'to_internal_value'),),
+}
+
+
+def install_timers():
+    """
+    Подменяет методы из TIMED_METHODS на уровне классов, то есть
+    для всего процесса, а не только для выбранных запросов: вне замера
+    обертка стоит одного чтения ContextVar. Подмена делается один раз
+    и не снимается, пока процесс жив.
+    """
+    for name, methods in TIMED_METHODS.items():
+        for cls, attribute in methods:
+            method = getattr(cls, attribute)
+            if not getattr(method, 'profiled', False):
+                setattr(cls, attribute, timed(name, method))
+
+
+class MemoryTracer:
+    """
+    Пик памяти запроса через tracemalloc. Трассировка глобальна
+    для процесса: пока запросы идут параллельно (потоки gthread,
+    ASGI), в пик попадают чужие выделения. Поэтому замер начинается,
+    только если других запросов в процессе нет, и отбрасывается,
+    если за время замера пришел еще один запрос.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._active = 0
+        self._owner = None
+        self._overlapped = False
+
+    def enter(self, profile=None):
+        with self._lock:
+            self._active += 1
+            if self._owner is not None:
+                self._overlapped = True
+            elif (profile is not None and self._active == 1
+                    and not tracemalloc.is_tracing()):
+                self._owner = profile
+                self._overlapped = False
+                tracemalloc.start()
+
+    def exit(self, profile=None):
+        """Пик памяти в байтах или None, если замера не было."""
+        with self._lock:
+            self._active -= 1
+            if profile is None or self._owner is not profile:
+                return None
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self._owner = None
+            return None if self._overlapped else peak
+
+
+memory_tracer = MemoryTracer()
+
+
+class ProfilingMiddleware:
+    """
+    Выборочное профилирование запросов (доля PROFILING_SAMPLE_RATE):
+    число и время SQL-запросов, повторяющиеся запросы (N+1),
+    время сериализации, валидации и декодирования изображений,
+    пик выделенной памяти (когда запрос выполнялся в процессе один).
+    Результат - заголовок Server-Timing и строка лога в JSON.
+    Работает и в WSGI, и в ASGI. При PROFILING_SAMPLE_RATE = 0
+    middleware отключается целиком и ничего не стоит.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.PROFILING_SAMPLE_RATE <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            # Так Django 3.2 узнает, что экземпляр вызывается через await.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        install_timers()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total, peak = self.stop(profile, token, started)
+        if profile is not None:
+            self.report(request, response, profile, total, peak)
+        return response
+
+    async def __acall__(self, request):
+        profile, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total, peak = self.stop(profile, token, started)
+        if profile is not None:
+            self.report(request, response, profile, total, peak)
+        return response
+
+    def start(self):
+        profile = token = None
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            profile = RequestProfile()
+            token = _profile.set(profile)
+        memory_tracer.enter(profile)
+        return profile, token
+
+    def stop(self, profile, token, started):
+        total = time.perf_counter() - started
+        peak = memory_tracer.exit(profile)
+        if token is not None:
+            _profile.reset(token)
+        return total, peak
+
+    def report(self, request, response, profile, total, peak):
+        duplicates = profile.duplicates()
+        query_count = sum(profile.queries.values())
+        metrics = [
+            f'db;dur={profile.db_time * 1000:.1f};desc="{query_count} SQL"',
+            *(
+                f'{name};dur={duration * 1000:.1f}'
+                for name, duration in profile.timings.items()
+            ),
+            f'total;dur={total * 1000:.1f}',
+        ]
+        if duplicates:
+            metrics.append(f'dup;desc="{len(duplicates)} N+1"')
+        response['Server-Timing'] = ', '.join(metrics)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'queries': query_count,
+            'db_ms': round(profile.db_time * 1000, 2),
+            **{
+                f'{name}_ms': round(duration * 1000, 2)
+                for name, duration in profile.timings.items()
+            },
+            'alloc_peak_kb': None if peak is None else round(peak / 1024, 1),
+            'duplicates': duplicates,
+        }, ensure_ascii=False))
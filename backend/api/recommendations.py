@@ -0,0 +1,141 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max
+from scipy import sparse
+
+from recipes.models import FavouriteRecipe, SimilarRecipe
+
+
+def read_chunks(queryset, key, fields, chunk_size):
+    """
+    Строки queryset порциями по возрастанию key (первое из fields)
+    в массивах NumPy: в памяти Python не больше chunk_size строк.
+    """
+    last = 0
+    while True:
+        rows = list(queryset.filter(**{f'{key}__gt': last}).order_by(
+            key
+        ).values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        chunk = np.array(rows, dtype=np.int64)
+        last = int(chunk[-1, 0])
+        yield chunk
+
+
+def favorites_matrix(chunk_size):
+    """
+    Разреженная матрица рецепты x пользователи (CSR) со строками,
+    нормированными для косинусного сходства, и id рецептов строк.
+    Размеры строк считаются в БД, после чего избранное порциями
+    раскладывается прямо в массивы матрицы: кроме нее в памяти
+    только текущая порция. Столбцы - id пользователей.
+    """
+    limits = FavouriteRecipe.objects.aggregate(
+        last_id=Max('id'), last_user=Max('user_id'),
+    )
+    # Избранное, добавленное во время расчета, не учитывается.
+    favorites = FavouriteRecipe.objects.filter(
+        id__lte=limits['last_id'] or 0
+    )
+    counts = list(read_chunks(
+        favorites.values('recipe_id').annotate(count=Count('id')),
+        'recipe_id', ('recipe_id', 'count'), chunk_size,
+    ))
+    if not counts:
+        return None, np.empty(0, dtype=np.int64)
+    counts = np.concatenate(counts)
+    recipe_ids, sizes = counts[:, 0], counts[:, 1]
+    indptr = np.zeros(len(recipe_ids) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    filled = np.zeros(len(recipe_ids), dtype=np.int64)
+    for chunk in read_chunks(
+        favorites, 'id', ('id', 'user_id', 'recipe_id'), chunk_size,
+    ):
+        rows = np.minimum(
+            np.searchsorted(recipe_ids, chunk[:, 2]), len(recipe_ids) - 1,
+        )
+        # Строки, появившиеся после подсчета, пропускаются.
+        known = (
+            (recipe_ids[rows] == chunk[:, 2])
+            & (chunk[:, 1] <= limits['last_user'])
+        )
+        rows, users = rows[known], chunk[known, 1]
+        order = np.argsort(rows, kind='stable')
+        rows, users = rows[order], users[order]
+        # Место строки избранного среди строк того же рецепта.
+        slots = filled[rows] + np.arange(len(rows)) - np.searchsorted(
+            rows, rows,
+        )
+        fits = slots < sizes[rows]
+        indices[indptr[rows[fits]] + slots[fits]] = users[fits]
+        changed, added = np.unique(rows[fits], return_counts=True)
+        filled[changed] += added
+    if (filled < sizes).any():
+        # Часть избранного удалили после подсчета: убираем пустые места.
+        offsets = np.arange(len(indices)) - np.repeat(indptr[:-1], sizes)
+        indices = indices[offsets < np.repeat(filled, sizes)]
+        np.cumsum(filled, out=indptr[1:])
+    weights = np.zeros(len(filled), dtype=np.float32)
+    weights[filled > 0] = 1 / np.sqrt(filled[filled > 0])
+    matrix = sparse.csr_matrix(
+        (np.repeat(weights, filled), indices, indptr),
+        shape=(len(recipe_ids), limits['last_user'] + 1),
+    )
+    return matrix, recipe_ids
+
+
+def similar_recipes(matrix, recipe_ids, top_k, block_size):
+    """
+    Для каждого рецепта - до top_k самых похожих (id, сходство).
+    Произведение матриц считается блоками по block_size рецептов:
+    сверх самой матрицы в памяти только произведение одного блока.
+    """
+    transposed = matrix.T.tocsc()
+    for start in range(0, matrix.shape[0], block_size):
+        block = matrix[start:start + block_size].dot(transposed).tocsr()
+        for row in range(block.shape[0]):
+            begin, end = block.indptr[row], block.indptr[row + 1]
+            columns = block.indices[begin:end]
+            scores = block.data[begin:end]
+            other = columns != start + row
+            columns, scores = columns[other], scores[other]
+            if len(scores) > top_k:
+                top = np.argpartition(-scores, top_k)[:top_k]
+                columns, scores = columns[top], scores[top]
+            yield recipe_ids[start + row], recipe_ids[columns], scores
+
+
+def build_similar_recipes(top_k=20, chunk_size=100_000, block_size=1000):
+    """
+    Пересчитывает таблицу похожих рецептов целиком.
+    Старая таблица заменяется новой в одной транзакции:
+    эндпоинт похожих рецептов не видит промежуточного состояния.
+    """
+    matrix, recipe_ids = favorites_matrix(chunk_size)
+    if matrix is None:
+        SimilarRecipe.objects.all().delete()
+        return 0
+    created = 0
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        batch = []
+        for recipe_id, similar_ids, scores in similar_recipes(
+            matrix, recipe_ids, top_k, block_size
+        ):
+            batch.extend(
+                SimilarRecipe(
+                    recipe_id=int(recipe_id),
+                    similar_id=int(similar_id),
+                    score=float(score),
+                )
+                for similar_id, score in zip(similar_ids, scores)
+            )
+            if len(batch) >= chunk_size:
+                SimilarRecipe.objects.bulk_create(batch, batch_size=1000)
+                created += len(batch)
+                batch = []
+        SimilarRecipe.objects.bulk_create(batch, batch_size=1000)
+        created += len(batch)
+    return created
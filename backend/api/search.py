@@ -0,0 +1,62 @@
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+
+from api.indexes import recipe_search_index
+from recipes.models import IngredientInRecipe, Recipe
+
+SEARCH_CONFIG = 'russian'
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def recipe_search_vector():
+    """Вектор рецепта: название (A), ингредиенты (B) и описание (C)."""
+    ingredients = Subquery(
+        IngredientInRecipe.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(
+            names=StringAgg('ingredient__name', delimiter=' '),
+        ).values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(ingredients, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(recipes):
+    """
+    Пересчитывает сохраненный вектор одним UPDATE.
+    recipes - queryset рецептов или список их id.
+    """
+    if not is_postgresql():
+        return
+    if not hasattr(recipes, 'update'):
+        recipes = Recipe.objects.filter(pk__in=recipes)
+    recipes.update(search_vector=recipe_search_vector())
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, подходящие под запрос, по убыванию релевантности.
+    В PostgreSQL - по GIN-индексу вектора, в остальных базах -
+    по индексу в памяти процесса.
+    """
+    if is_postgresql():
+        query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch',
+        )
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query),
+        ).order_by('-rank', '-id')
+    recipe_ids = recipe_search_index.search(query)
+    return queryset.filter(id__in=recipe_ids).order_by(Case(
+        *[When(id=pk, then=Value(position))
+          for position, pk in enumerate(recipe_ids)],
+        default=Value(len(recipe_ids)),
+    ))
@@ -2,16 +2,19 @@ import re
 
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers, status
 from rest_framework.fields import SerializerMethodField
 from rest_framework.relations import PrimaryKeyRelatedField
 
+from api.fields import RecipeImageField
+from api.images import RENDITIONS, rendition_url
 from api.pagination import SubscribePagination
 from foodgram.settings import (MAX_COOKING_TIME, MAX_INGREDIENT_VALUE,
                                MAX_LENGTH_EMAIL, MAX_LENGTH_USER_MODEL,
-                               MIN_UNIT)
+                               MIN_UNIT, PANTRY_MAX_INGREDIENTS)
 from recipes.models import (FavouriteRecipe, Ingredient, IngredientInRecipe,
                             Recipe, ShoppingCart, Tag)
 from users.models import Subscribe
@@ -19,6 +22,51 @@ from users.models import Subscribe
 User = get_user_model()
 
 
+def recipe_prefetches():
+    """Связанные данные рецепта, которые читает ReadRecipeSerializer."""
+    return (
+        'tags',
+        Prefetch(
+            'recipes',
+            queryset=IngredientInRecipe.objects.select_related(
+                'ingredient'
+            ).order_by('ingredient__name'),
+        ),
+    )
+
+
+def recipe_previews(authors, request):
+    """
+    Последние recipes_limit рецептов для всех авторов страницы
+    одним запросом с ROW_NUMBER() OVER (PARTITION BY author_id).
+    Возвращает словарь id автора -> список рецептов.
+    """
+    previews = {author.id: [] for author in authors}
+    if not previews:
+        return previews
+    ranked = Recipe.objects.filter(author_id__in=previews).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=F('id').desc(),
+        ),
+    ).order_by().values(
+        'id', 'name', 'image', 'image_renditions', 'cooking_time',
+        'author_id', 'position',
+    )
+    # Django 3.2 не умеет фильтровать по оконной функции,
+    # поэтому ограничение накладывается во внешнем запросе.
+    sql, params = ranked.query.sql_with_params()
+    recipes = Recipe.objects.raw(
+        f'SELECT * FROM ({sql}) ranked WHERE position <= %s '
+        'ORDER BY author_id, id DESC',
+        (*params, SubscribePagination().get_page_size(request)),
+    )
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    return previews
+
+
 class ProjectUserSerializer(UserSerializer):
     """Сериализатор для использования данных пользователя."""
     is_subscribed = SerializerMethodField()
@@ -38,6 +86,9 @@ class ProjectUserSerializer(UserSerializer):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        viewer = self.context.get('viewer')
+        if viewer is not None:
+            return viewer.is_subscribed(obj)
         return obj.subscribing.filter(user=user).exists()
 
 
@@ -92,7 +143,7 @@ class ProjectUserCreateSerializer(UserCreateSerializer):
 class SubscribeSerializer(ProjectUserSerializer):
     """Сериализатор для демонстрации подписок пользователя."""
     recipes = SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='recipes.count')
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta(ProjectUserSerializer.Meta):
         fields = ProjectUserSerializer.Meta.fields + (
@@ -123,12 +174,10 @@ class SubscribeSerializer(ProjectUserSerializer):
         return data
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes = SubscribePagination().paginate_queryset(
-            obj.recipes.all(),
-            request,
-        )
-        return SmallRecipeSerializer(recipes, many=True).data
+        previews = self.context.get('recipe_previews')
+        if previews is None:
+            previews = recipe_previews([obj], self.context.get('request'))
+        return SmallRecipeSerializer(previews[obj.id], many=True).data
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -162,9 +211,7 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
 
 class RecordIngredientInRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для модели ингридиенты в рецептах."""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-    )
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(
         min_value=MIN_UNIT,
         max_value=MAX_INGREDIENT_VALUE,
@@ -180,7 +227,7 @@ class SmallRecipeSerializer(serializers.ModelSerializer):
     Вспомогательный сериализатор к модели подписки
     для вывода данных по рецептам у подписчика.
     """
-    image = Base64ImageField(read_only=True)
+    image = SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -195,6 +242,44 @@ class SmallRecipeSerializer(serializers.ModelSerializer):
             'name',
         )
 
+    def get_image(self, obj):
+        return rendition_url(obj, 'thumbnail', self.context.get('request'))
+
+
+class PantrySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_MAX_INGREDIENTS,
+    )
+    tags = serializers.ListField(
+        child=serializers.SlugField(),
+        required=False,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class PantryRecipeSerializer(SmallRecipeSerializer):
+    """
+    Рецепт в подборе по ингредиентам: доля имеющихся ингредиентов
+    и число недостающих (из контекста 'pantry').
+    """
+    coverage = SerializerMethodField()
+    missing_ingredients = SerializerMethodField()
+
+    class Meta(SmallRecipeSerializer.Meta):
+        fields = SmallRecipeSerializer.Meta.fields + (
+            'coverage',
+            'missing_ingredients',
+        )
+
+    def get_coverage(self, obj):
+        return round(self.context['pantry'][obj.id][0], 3)
+
+    def get_missing_ingredients(self, obj):
+        return self.context['pantry'][obj.id][1]
+
 
 class ReadRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для демонстрации рецепта."""
@@ -208,7 +293,8 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
         read_only=True,
         source='recipes',
     )
-    image = Base64ImageField()
+    image = SerializerMethodField()
+    images = SerializerMethodField()
     is_favorited = SerializerMethodField(read_only=True)
     is_in_shopping_cart = SerializerMethodField(read_only=True)
 
@@ -220,6 +306,7 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
             'author',
             'ingredients',
             'image',
+            'images',
             'is_favorited',
             'is_in_shopping_cart',
             'name',
@@ -232,10 +319,27 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
         return (user.is_authenticated
                 and model.objects.filter(user=user, recipe=obj).exists())
 
+    def get_image(self, obj):
+        view = self.context.get('view')
+        name = 'card' if view is not None and view.action == 'list' else 'full'
+        return rendition_url(obj, name, self.context.get('request'))
+
+    def get_images(self, obj):
+        request = self.context.get('request')
+        return {
+            name: rendition_url(obj, name, request) for name in RENDITIONS
+        }
+
     def get_is_favorited(self, obj):
+        viewer = self.context.get('viewer')
+        if viewer is not None:
+            return viewer.is_favorited(obj)
         return self.general_value(FavouriteRecipe, obj)
 
     def get_is_in_shopping_cart(self, obj):
+        viewer = self.context.get('viewer')
+        if viewer is not None:
+            return viewer.is_in_shopping_cart(obj)
         return self.general_value(ShoppingCart, obj)
 
 
@@ -254,7 +358,7 @@ class RecordRecipeSerializer(serializers.ModelSerializer):
         required=True,
         allow_null=False,
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
     cooking_time = serializers.IntegerField(
         min_value=MIN_UNIT,
         max_value=MAX_COOKING_TIME,
@@ -282,6 +386,19 @@ class RecordRecipeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'ingredients': 'Этот ингридиент уже добавлен!'}
             )
+        ingredients = Ingredient.objects.in_bulk(
+            [element['id'] for element in value]
+        )
+        missing = [
+            element['id'] for element in value
+            if element['id'] not in ingredients
+        ]
+        if missing:
+            raise serializers.ValidationError(
+                {'ingredients': f'Ингредиенты не существуют: {missing}'}
+            )
+        for element in value:
+            element['id'] = ingredients[element['id']]
         return value
 
     def validate_tags(self, value):
@@ -295,19 +412,39 @@ class RecordRecipeSerializer(serializers.ModelSerializer):
             )
         return value
 
-    @transaction.atomic
-    def add_ingredients(self, recipe, ingredients):
-        ingredients = [IngredientInRecipe(
-            ingredient=Ingredient.objects.get(id=ingredient['id'].id),
-            recipe=recipe,
-            amount=ingredient['amount']
-        ) for ingredient in ingredients]
-        IngredientInRecipe.objects.bulk_create(
-            sorted(
-                ingredients,
-                key=lambda obj: obj.ingredient.name
+    def save_ingredients(self, recipe, ingredients, current=()):
+        """
+        Применяет к рецепту только разницу со списком ингредиентов:
+        удаляет лишние, обновляет изменившиеся количества и добавляет новые.
+        """
+        amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {row.ingredient_id: row for row in current}
+        removed = [
+            row.id for ingredient_id, row in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                ingredient_id=ingredient_id,
+                recipe=recipe,
+                amount=amount,
             )
-        )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ])
 
     @transaction.atomic
     def create(self, validated_data):
@@ -315,7 +452,7 @@ class RecordRecipeSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         recipe = super().create(validated_data)
         recipe.tags.set(tags)
-        self.add_ingredients(recipe=recipe, ingredients=ingredients)
+        self.save_ingredients(recipe=recipe, ingredients=ingredients)
         return recipe
 
     @transaction.atomic
@@ -323,14 +460,16 @@ class RecordRecipeSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         instance = super().update(instance, validated_data)
-        instance.tags.clear()
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.add_ingredients(recipe=instance, ingredients=ingredients)
-        instance.save()
+        self.save_ingredients(
+            recipe=instance,
+            ingredients=ingredients,
+            current=instance.recipes.all(),
+        )
         return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], *recipe_prefetches())
         context = {'request': self.context['request']}
         return ReadRecipeSerializer(instance, context=context).data
 
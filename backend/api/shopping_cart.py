@@ -0,0 +1,88 @@
+import csv
+import json
+
+from django.db.models import Case, CharField, F, IntegerField, Sum, Value, When
+
+from recipes.models import IngredientInRecipe
+
+# Единицы, приводимые к базовой: единица -> (базовая единица, множитель).
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
+CHUNK_SIZE = 2000
+
+
+def shopping_cart_ingredients(user):
+    """
+    Суммарное количество ингредиентов из списка покупок пользователя.
+    Совместимые единицы (г/кг, мл/л) сводятся к базовой на стороне БД.
+    """
+    unit_field = 'ingredient__measurement_unit'
+    unit = Case(
+        *[When(**{unit_field: name}, then=Value(base))
+          for name, (base, _) in UNIT_CONVERSIONS.items()],
+        default=F(unit_field),
+        output_field=CharField(),
+    )
+    factor = Case(
+        *[When(**{unit_field: name}, then=Value(multiplier))
+          for name, (_, multiplier) in UNIT_CONVERSIONS.items()],
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+    return IngredientInRecipe.objects.filter(
+        recipe__shopping_cart__user=user
+    ).annotate(
+        unit=unit,
+    ).values(
+        'ingredient__name', 'unit',
+    ).annotate(
+        total=Sum(F('amount') * factor),
+    ).order_by('ingredient__name', 'unit')
+
+
+def shopping_cart_rows(user):
+    """Строки (название, единица, количество) для выгрузки."""
+    for row in shopping_cart_ingredients(user).iterator(
+        chunk_size=CHUNK_SIZE
+    ):
+        yield row['ingredient__name'], row['unit'], row['total']
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def export_txt(user, rows):
+    yield f'Список покупок для: {user.get_full_name()}\n\n'
+    for name, unit, amount in rows:
+        yield f'- {name} ({unit}) - {amount}\n'
+
+
+def export_csv(user, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def export_json(user, rows):
+    separator = '['
+    for name, unit, amount in rows:
+        yield separator + json.dumps(
+            {'name': name, 'measurement_unit': unit, 'amount': amount},
+            ensure_ascii=False,
+        )
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+EXPORTERS = {
+    'txt': (export_txt, 'text/plain; charset=utf-8'),
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'json': (export_json, 'application/json'),
+}
@@ -0,0 +1,236 @@
+from contextvars import ContextVar, copy_context
+from functools import partial, wraps
+
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.db.models.deletion import Collector
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import CACHED_USER_FIELDS, invalidate_token
+from api.cache import (INGREDIENTS_GENERATION_KEY, PANTRY_GENERATION_KEY,
+                       TAGS_GENERATION_KEY, bump_generation)
+from api.counters import change_counter
+from api.db import close_unusable_connections
+from api.feed import follow, unfollow
+from api.images import (delete_renditions, needs_renditions,
+                        schedule_renditions)
+from api.indexes import record_pantry_change
+from api.search import update_search_vectors
+from recipes.models import (FavouriteRecipe, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, Tag)
+from users.models import ProjectUser, Subscribe
+
+# Рецепты и пользователи, удаляемые сейчас вместе со связанными
+# строками. Collector шлет pre_delete для всех собранных объектов
+# до удаления, поэтому построчные обработчики связанных строк
+# пропускают работу, которая станет ненужной: счетчики и индексы
+# удаляемого рецепта или пользователя.
+_deleting = ContextVar('deleting', default=frozenset())
+_collector_delete = Collector.delete
+
+
+@wraps(_collector_delete)
+def _delete_in_own_context(self):
+    # Отметки живут только внутри удаления: если оно прервется
+    # ошибкой, они не останутся в контексте потока и не отключат
+    # счетчики уцелевших рецептов и пользователей.
+    return copy_context().run(_collector_delete, self)
+
+
+Collector.delete = _delete_in_own_context
+
+
+@receiver(pre_delete, sender=Recipe)
+@receiver(pre_delete, sender=ProjectUser)
+def mark_deleting(sender, instance, **kwargs):
+    _deleting.set(_deleting.get() | {(sender, instance.pk)})
+
+
+def is_deleting(model, pk):
+    return (model, pk) in _deleting.get()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes_cache(sender, instance, action=None, **kwargs):
+    if sender is IngredientInRecipe and is_deleting(
+        Recipe, instance.recipe_id
+    ):
+        return
+    if action is None or action.startswith('post_'):
+        transaction.on_commit(bump_generation)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients_catalog(**kwargs):
+    # После коммита: иначе параллельный запрос успеет перестроить
+    # индекс по старым строкам под новым поколением.
+    transaction.on_commit(
+        partial(bump_generation, INGREDIENTS_GENERATION_KEY)
+    )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags_catalog(**kwargs):
+    transaction.on_commit(partial(bump_generation, TAGS_GENERATION_KEY))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def refresh_search_vector(sender, instance, **kwargs):
+    # После коммита: к этому моменту ингредиенты рецепта уже сохранены
+    # (в сериализаторе они пишутся bulk-операциями без сигналов).
+    recipe_id = instance.pk if sender is Recipe else instance.recipe_id
+    if is_deleting(Recipe, recipe_id):
+        return
+    transaction.on_commit(partial(update_search_vectors, [recipe_id]))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def refresh_pantry_index(sender, instance, action=None, reverse=False,
+                         pk_set=None, **kwargs):
+    if action is not None and not action.startswith('post_'):
+        return
+    if reverse and pk_set is None:
+        # Тэг отвязан сразу от всех рецептов: индекс строится заново.
+        transaction.on_commit(
+            partial(bump_generation, PANTRY_GENERATION_KEY)
+        )
+        return
+    if reverse:
+        recipe_ids = pk_set
+    elif sender is IngredientInRecipe:
+        if is_deleting(Recipe, instance.recipe_id):
+            return
+        recipe_ids = [instance.recipe_id]
+    else:
+        recipe_ids = [instance.pk]
+    for recipe_id in recipe_ids:
+        transaction.on_commit(partial(record_pantry_change, recipe_id))
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_search_vectors(instance, created=False, **kwargs):
+    if not created:
+        transaction.on_commit(partial(
+            update_search_vectors,
+            Recipe.objects.filter(ingredients=instance),
+        ))
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(instance, **kwargs):
+    if needs_renditions(instance):
+        schedule_renditions(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_renditions(instance, **kwargs):
+    if 'image_renditions' not in instance.get_deferred_fields() and (
+        instance.image_renditions
+    ):
+        transaction.on_commit(
+            partial(delete_renditions, instance.image_renditions)
+        )
+
+
+@receiver(post_save, sender=FavouriteRecipe)
+@receiver(post_delete, sender=FavouriteRecipe)
+def count_favorites(instance, created=False, **kwargs):
+    if created or (kwargs['signal'] is post_delete and not is_deleting(
+        Recipe, instance.recipe_id
+    )):
+        change_counter(
+            Recipe, instance.recipe_id, 'favorites_count',
+            1 if created else -1,
+        )
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def count_in_carts(instance, created=False, **kwargs):
+    if created or (kwargs['signal'] is post_delete and not is_deleting(
+        Recipe, instance.recipe_id
+    )):
+        change_counter(
+            Recipe, instance.recipe_id, 'in_carts_count',
+            1 if created else -1,
+        )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def count_author_recipes(instance, created=False, **kwargs):
+    if instance.author_id and (
+        created or (kwargs['signal'] is post_delete and not is_deleting(
+            ProjectUser, instance.author_id
+        ))
+    ):
+        change_counter(
+            ProjectUser, instance.author_id, 'recipes_count',
+            1 if created else -1,
+        )
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def count_followers(instance, created=False, **kwargs):
+    if created or (kwargs['signal'] is post_delete and not is_deleting(
+        ProjectUser, instance.author_id
+    )):
+        change_counter(
+            ProjectUser, instance.author_id, 'followers_count',
+            1 if created else -1,
+        )
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def update_feed(instance, created=False, **kwargs):
+    if created:
+        follow(instance.user_id, instance.author_id)
+    elif kwargs['signal'] is post_delete and not (
+        is_deleting(ProjectUser, instance.user_id)
+        or is_deleting(ProjectUser, instance.author_id)
+    ):
+        # Записи ленты удаляемого пользователя удалятся каскадом.
+        unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    transaction.on_commit(partial(invalidate_token, instance.key))
+
+
+@receiver(post_save, sender=ProjectUser)
+def invalidate_user_tokens(instance, created=False, update_fields=None,
+                           **kwargs):
+    # Сохранение только некэшируемых полей (last_login при входе)
+    # кэш токенов не меняет. Удаление пользователя удаляет его токены.
+    if created or (update_fields is not None
+                   and CACHED_USER_FIELDS.isdisjoint(update_fields)):
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ):
+        transaction.on_commit(partial(invalidate_token, key))
+
+
+request_started.connect(close_unusable_connections)
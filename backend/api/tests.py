@@ -0,0 +1,1227 @@
+import asyncio
+import base64
+import json
+import re
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.signals import pre_delete
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from api import recommendations
+from api.authentication import local_tokens, token_cache_key
+from api.cache import get_tag_ids_by_slug
+from api.metrics import MetricsMiddleware, install_query_counter
+from api.parsers import Base64JSONParser, unescape
+from api.profiling import MemoryTracer, RequestProfile
+from api.recommendations import build_similar_recipes
+from recipes.models import (FavouriteRecipe, FeedEntry, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart,
+                            SimilarRecipe, Tag)
+from users.models import ProjectUser, Subscribe
+
+# Таблицы, которые растут с числом пользователей и рецептов
+# (справочники тэгов и ингредиентов ограничены по размеру).
+SEQ_SCAN_RE = re.compile(
+    r'Seq Scan on (recipes_recipe|recipes_recipe_tags|'
+    r'recipes_ingredientinrecipe|recipes_favouriterecipe|'
+    r'recipes_shoppingcart|recipes_feedentry|users_projectuser|'
+    r'users_subscribe)\b'
+)
+
+
+def create_catalog(recipe_count=12):
+    """Пользователи, тэги, ингредиенты и рецепты для тестов API."""
+    users = [
+        ProjectUser.objects.create(
+            username=f'user{number}',
+            email=f'user{number}@example.com',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        for number in range(3)
+    ]
+    tags = [
+        Tag.objects.create(
+            name=f'Тэг {number}', color=f'#00000{number}', slug=f'tag{number}',
+        )
+        for number in range(3)
+    ]
+    ingredients = [
+        Ingredient.objects.create(
+            name=f'ингредиент {number}', measurement_unit='г',
+        )
+        for number in range(10)
+    ]
+    for number in range(recipe_count):
+        recipe = Recipe.objects.create(
+            name=f'Рецепт {number}',
+            author=users[number % 3],
+            text='Описание',
+            cooking_time=10,
+        )
+        recipe.tags.set(tags[:1 + number % 3])
+        for offset in range(3):
+            IngredientInRecipe.objects.create(
+                recipe=recipe,
+                ingredient=ingredients[(number + offset) % 10],
+                amount=100,
+            )
+        if number % 2:
+            FavouriteRecipe.objects.create(user=users[0], recipe=recipe)
+        if number % 3:
+            ShoppingCart.objects.create(user=users[0], recipe=recipe)
+    Subscribe.objects.create(user=users[0], author=users[1])
+    return users, tags, ingredients
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, _, _ = create_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_constant_queries(self, client):
+        with CaptureQueriesContext(connection) as page_of_six:
+            response = client.get('/api/recipes/?limit=6')
+        self.assertEqual(len(response.data['results']), 6)
+        cache.clear()
+        with self.assertNumQueries(len(page_of_six)):
+            response = client.get('/api/recipes/?limit=100')
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_anonymous(self):
+        self.assert_constant_queries(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        self.assert_constant_queries(client)
+
+
+@override_settings(ALLOWED_HOSTS=['localhost', 'foodgram.example.com'])
+class AnonymousCacheTest(TestCase):
+    """Закэшированный ответ не отдается по другому хосту и схеме."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=4)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, host, secure=False):
+        return self.client.get(
+            '/api/recipes/?limit=2', HTTP_HOST=host, secure=secure,
+        )
+
+    def test_host_and_scheme_in_key(self):
+        first = self.get('localhost')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(self.get('localhost')['X-Cache'], 'HIT')
+        for host, secure in (('foodgram.example.com', False),
+                             ('localhost', True)):
+            with self.subTest(host=host, secure=secure):
+                response = self.get(host, secure)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                scheme = 'https' if secure else 'http'
+                self.assertTrue(response.data['next'].startswith(
+                    f'{scheme}://{host}/'
+                ))
+
+
+class RecipeDeleteQueriesTest(TestCase):
+    """Удаление не обновляет счетчики по каждой связанной строке."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, _, _ = create_catalog(recipe_count=0)
+        cls.fans = ProjectUser.objects.bulk_create([
+            ProjectUser(username=f'fan{number}',
+                        email=f'fan{number}@example.com')
+            for number in range(20)
+        ])
+        cls.fans = list(ProjectUser.objects.filter(username__startswith='fan'))
+
+    def create_recipe(self, fans):
+        recipe = Recipe.objects.create(
+            name='Удаляемый', author=self.users[1], text='Описание',
+            cooking_time=10,
+        )
+        for fan in fans:
+            FavouriteRecipe.objects.create(user=fan, recipe=recipe)
+            ShoppingCart.objects.create(user=fan, recipe=recipe)
+        return recipe
+
+    def delete_queries(self, recipe):
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        with CaptureQueriesContext(connection) as queries:
+            response = client.delete(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, 204)
+        return len(queries)
+
+    def test_constant_queries(self):
+        few = self.delete_queries(self.create_recipe(self.fans[:2]))
+        many = self.delete_queries(self.create_recipe(self.fans))
+        self.assertEqual(few, many)
+        self.users[1].refresh_from_db()
+        self.assertEqual(self.users[1].recipes_count, 0)
+
+    def test_user_delete_updates_other_counters(self):
+        recipe = self.create_recipe(self.fans[:3])
+        self.users[1].refresh_from_db()
+        followers = self.users[1].followers_count
+        Subscribe.objects.create(user=self.fans[0], author=self.users[1])
+        self.fans[0].delete()
+        recipe.refresh_from_db()
+        self.users[1].refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 2)
+        self.assertEqual(recipe.in_carts_count, 2)
+        self.assertEqual(self.users[1].followers_count, followers)
+        self.users[1].delete()
+        recipe.refresh_from_db()
+        self.assertIsNone(recipe.author_id)
+
+    def test_failed_delete_keeps_counters(self):
+        recipe = self.create_recipe(self.fans[:3])
+
+        def fail(**kwargs):
+            raise RuntimeError('Удаление прервано.')
+
+        pre_delete.connect(fail, sender=Recipe)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                recipe.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=Recipe)
+        FavouriteRecipe.objects.filter(user=self.fans[0]).delete()
+        ShoppingCart.objects.filter(user=self.fans[0]).delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 2)
+        self.assertEqual(recipe.in_carts_count, 2)
+
+
+class ShoppingCartExportTest(TestCase):
+    """Выгрузка списка покупок: сведение единиц и форматы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ProjectUser.objects.create(
+            username='buyer', email='buyer@example.com',
+            first_name='Имя', last_name='Фамилия',
+        )
+        units = {
+            ('мука', 'г'): (200, 300), ('мука', 'кг'): (1, 0),
+            ('молоко', 'мл'): (500, 0), ('молоко', 'л'): (0, 2),
+            ('яйца', 'шт'): (2, 3),
+        }
+        recipes = [
+            Recipe.objects.create(
+                name=f'Покупка {number}', author=cls.user, text='Описание',
+                cooking_time=10,
+            )
+            for number in range(2)
+        ]
+        for (name, unit), amounts in units.items():
+            ingredient = Ingredient.objects.create(
+                name=name, measurement_unit=unit,
+            )
+            for recipe, amount in zip(recipes, amounts):
+                if amount:
+                    IngredientInRecipe.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=amount,
+                    )
+        for recipe in recipes:
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def download(self, file_format):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get(
+            f'/api/recipes/download_shopping_cart/?format={file_format}'
+        )
+
+    def content(self, file_format, content_type):
+        response = self.download(file_format)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], content_type)
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename=buyer_shopping_cart.{file_format}',
+        )
+        return b''.join(response.streaming_content).decode()
+
+    def test_txt(self):
+        self.assertEqual(
+            self.content('txt', 'text/plain; charset=utf-8'),
+            'Список покупок для: Имя Фамилия\n\n'
+            '- молоко (мл) - 2500\n'
+            '- мука (г) - 1500\n'
+            '- яйца (шт) - 5\n',
+        )
+
+    def test_csv(self):
+        self.assertEqual(
+            self.content('csv', 'text/csv; charset=utf-8'),
+            'name,measurement_unit,amount\r\n'
+            'молоко,мл,2500\r\n'
+            'мука,г,1500\r\n'
+            'яйца,шт,5\r\n',
+        )
+
+    def test_json(self):
+        self.assertEqual(
+            json.loads(self.content('json', 'application/json')),
+            [
+                {'name': 'молоко', 'measurement_unit': 'мл', 'amount': 2500},
+                {'name': 'мука', 'measurement_unit': 'г', 'amount': 1500},
+                {'name': 'яйца', 'measurement_unit': 'шт', 'amount': 5},
+            ],
+        )
+
+    def test_empty_json(self):
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertEqual(
+            json.loads(self.content('json', 'application/json')), [],
+        )
+
+    def test_pdf_not_supported(self):
+        # PDF не выгружается: для кириллицы нужна отдельная библиотека
+        # со шрифтом, а потоковую выдачу она не поддерживает.
+        self.assertEqual(self.download('pdf').status_code, 404)
+
+
+class RecipeIngredientsUpdateTest(TestCase):
+    """Обновление рецепта меняет только отличающиеся ингредиенты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.tags, _ = create_catalog(recipe_count=0)
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'продукт {number}', measurement_unit='г',
+            )
+            for number in range(25)
+        ]
+        cls.image = base64.b64encode(image_file('red').read()).decode()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def update(self, size):
+        """
+        Рецепт из 4 * size ингредиентов: size остаются как есть,
+        size меняют количество, 2 * size удаляются и size добавляются.
+        """
+        recipe = Recipe.objects.create(
+            name=f'Обновляемый {size}', author=self.users[0],
+            text='Описание', cooking_time=10,
+        )
+        recipe.tags.set(self.tags[:1])
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                               amount=100)
+            for ingredient in self.ingredients[:4 * size]
+        ])
+        kept = self.ingredients[:size]
+        changed = self.ingredients[size:2 * size]
+        added = self.ingredients[4 * size:5 * size]
+        # Оставшиеся и измененные строки не пересоздаются.
+        updated_rows = set(IngredientInRecipe.objects.filter(
+            recipe=recipe, ingredient__in=kept + changed,
+        ).values_list('id', flat=True))
+        expected = {
+            **{ingredient.id: 100 for ingredient in kept},
+            **{ingredient.id: 200 for ingredient in changed},
+            **{ingredient.id: 50 for ingredient in added},
+        }
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(f'/api/recipes/{recipe.id}/', {
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'image': f'data:image/png;base64,{self.image}',
+                'tags': [self.tags[0].id],
+                'ingredients': [
+                    {'id': ingredient_id, 'amount': amount}
+                    for ingredient_id, amount in expected.items()
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        rows = IngredientInRecipe.objects.filter(recipe=recipe)
+        self.assertEqual(
+            dict(rows.values_list('ingredient_id', 'amount')), expected,
+        )
+        self.assertLessEqual(
+            updated_rows, set(rows.values_list('id', flat=True)),
+        )
+        return len(queries)
+
+    def test_constant_queries(self):
+        self.assertEqual(self.update(1), self.update(5))
+
+
+class RecipeConditionalGetTest(TestCase):
+    """Условные GET-запросы к рецепту."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=3)
+        cls.recipe = Recipe.objects.order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_invalid_pk(self):
+        for url in ('/api/recipes/abc/', '/api/recipes/abc/similar/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_cached_anonymous_retrieve_skips_database(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class RecipeCursorTest(TestCase):
+    """Курсор не сочетается с сортировкой, отличной от -id."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=4)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_cursor_with_other_ordering(self):
+        for query in ('search=Рецепт', 'ordering=popular'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/recipes/?cursor=&{query}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.data)
+
+
+class PantrySearchTest(TestCase):
+    """Поиск по имеющимся ингредиентам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        _, _, cls.ingredients = create_catalog(recipe_count=6)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_ignored(self):
+        query = '&'.join(
+            f'ingredients={ingredient.id}'
+            for ingredient in self.ingredients[:4]
+        )
+        for params in ('', '&cursor=', '&cursor=abc&limit=2'):
+            with self.subTest(params=params):
+                response = self.client.get(
+                    f'/api/recipes/by-ingredients/?{query}{params}'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('count', response.data)
+                self.assertGreater(len(response.data['results']), 0)
+
+
+class SubscriptionRecipesTest(TestCase):
+    """Последние рецепты авторов в подписках и ограничение recipes_limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, _, _ = create_catalog(recipe_count=0)
+        cls.empty = ProjectUser.objects.create(
+            username='empty', email='empty@example.com',
+        )
+        cls.recipes = {
+            author.id: [
+                Recipe.objects.create(
+                    name=f'{author.username} {number}', author=author,
+                    text='Описание', cooking_time=10,
+                ).id
+                for number in range(count)
+            ][::-1]
+            for author, count in ((cls.users[1], 8), (cls.users[2], 1))
+        }
+        cls.recipes[cls.empty.id] = []
+        for author in (cls.users[2], cls.empty):
+            Subscribe.objects.create(user=cls.users[0], author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def previews(self, query=''):
+        response = self.client.get(f'/api/users/subscriptions/{query}')
+        self.assertEqual(response.status_code, 200)
+        return {
+            author['id']: [recipe['id'] for recipe in author['recipes']]
+            for author in response.data['results']
+        }
+
+    def expected(self, limit):
+        return {
+            author_id: recipes[:limit]
+            for author_id, recipes in self.recipes.items()
+        }
+
+    def test_limit_per_author(self):
+        for limit in (1, 2, 10):
+            with self.subTest(limit=limit):
+                self.assertEqual(
+                    self.previews(f'?recipes_limit={limit}'),
+                    self.expected(limit),
+                )
+
+    def test_invalid_limit(self):
+        # Некорректное значение заменяется размером страницы по умолчанию.
+        for limit in ('-1', '0', 'abc'):
+            with self.subTest(limit=limit):
+                self.assertEqual(
+                    self.previews(f'?recipes_limit={limit}'),
+                    self.expected(6),
+                )
+        self.assertEqual(self.previews(), self.expected(6))
+
+    def test_subscribe(self):
+        client = APIClient()
+        client.force_authenticate(self.empty)
+        author = self.users[1]
+        response = client.post(
+            f'/api/users/{author.id}/subscribe/?recipes_limit=3'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['recipes']],
+            self.recipes[author.id][:3],
+        )
+
+
+class FeedTest(TestCase):
+    """Лента: рассылка при публикации, подписка, отписка и популярные."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.tags, cls.ingredients = create_catalog(
+            recipe_count=0
+        )
+        cls.reader, cls.author, cls.other = cls.users
+        cls.image = base64.b64encode(image_file('red').read()).decode()
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def publish(self, author):
+        response = self.client_for(author).post('/api/recipes/', {
+            'name': f'Рецепт {Recipe.objects.count()}',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': f'data:image/png;base64,{self.image}',
+            'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 10}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def feed(self, user, limit=2):
+        """Id рецептов ленты по всем страницам курсора."""
+        client = self.client_for(user)
+        url = f'/api/feed/?limit={limit}'
+        ids = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_fan_out_on_publish(self):
+        recipe_id = self.publish(self.author)
+        self.assertEqual(self.feed(self.reader), [recipe_id])
+        self.assertEqual(self.feed(self.other), [])
+
+    @override_settings(FEED_BACKFILL=2)
+    def test_backfill_on_follow(self):
+        recipe_ids = [self.publish(self.other) for _ in range(3)]
+        response = self.client_for(self.reader).post(
+            f'/api/users/{self.other.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.feed(self.reader), recipe_ids[:0:-1])
+
+    def test_unfollow(self):
+        kept = self.publish(self.author)
+        Subscribe.objects.create(user=self.reader, author=self.other)
+        self.publish(self.other)
+        response = self.client_for(self.reader).delete(
+            f'/api/users/{self.other.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.feed(self.reader), [kept])
+
+    @override_settings(FEED_FANOUT_LIMIT=2)
+    def test_popular_authors_pulled(self):
+        # У other два подписчика: его рецепты не рассылаются,
+        # а подтягиваются в ленту при чтении.
+        for user in (self.reader, self.author):
+            Subscribe.objects.create(user=user, author=self.other)
+        recipe_ids = [
+            self.publish(author)
+            for author in (self.author, self.other, self.other,
+                           self.author, self.other)
+        ]
+        self.assertFalse(
+            FeedEntry.objects.filter(recipe__author=self.other).exists()
+        )
+        self.assertEqual(self.feed(self.reader), recipe_ids[::-1])
+        # Повторное чтение подтягивает только новые рецепты.
+        recipe_ids.append(self.publish(self.other))
+        self.assertEqual(self.feed(self.reader), recipe_ids[::-1])
+
+
+class IngredientCatalogTest(TestCase):
+    """Новый ингредиент виден в справочнике и автодополнении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_new_ingredient(self):
+        catalog = self.client.get('/api/ingredients/')
+        autocomplete = self.client.get('/api/ingredients/?name=ингр')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(
+                '/api/ingredients/?name=ингр',
+                HTTP_IF_NONE_MATCH=autocomplete['ETag'],
+            ).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.create(
+                name='ингредиент новый', measurement_unit='г',
+            )
+        response = self.client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=catalog['ETag'],
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(ingredient.id, [row['id'] for row in response.data])
+        response = self.client.get(
+            '/api/ingredients/?name=ингр',
+            HTTP_IF_NONE_MATCH=autocomplete['ETag'],
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(ingredient.id, [row['id'] for row in response.data])
+
+    def test_generation_bumped_after_commit(self):
+        self.client.get('/api/ingredients/?name=ингр')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.create(
+                name='ингредиент поздний', measurement_unit='г',
+            )
+            # До коммита индекс не перестраивается по новому поколению.
+            self.assertEqual(len(self.client.get(
+                '/api/ingredients/?name=ингредиент п'
+            ).data), 0)
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.client.get(
+            '/api/ingredients/?name=ингредиент п'
+        ).data), 1)
+
+
+class TagFilterTest(TestCase):
+    """Фильтр по тэгам видит тэги, созданные в другом процессе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_generation_bumped_after_commit(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        get_tag_ids_by_slug()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tag.objects.create(name='Поздний', color='#EEEEEE', slug='late')
+            # До коммита ни справочник, ни ETag не обновляются.
+            self.assertEqual(self.client.get(
+                '/api/tags/', HTTP_IF_NONE_MATCH=etag
+            ).status_code, 304)
+            self.assertNotIn('late', get_tag_ids_by_slug())
+        for callback in callbacks:
+            callback()
+        self.assertIn('late', get_tag_ids_by_slug())
+        self.assertEqual(
+            self.client.get('/api/recipes/?tags=late').status_code, 200
+        )
+        self.assertEqual(self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=etag
+        ).status_code, 200)
+
+    @override_settings(TAGS_CACHE_TIMEOUT=1)
+    def test_new_tag_after_timeout(self):
+        self.assertEqual(
+            self.client.get('/api/recipes/?tags=tag0').status_code, 200
+        )
+        # bulk_create без сигналов - как запись в другом процессе
+        # при кэше, не общем для процессов.
+        Tag.objects.bulk_create([
+            Tag(name='Новый', color='#FFFFFF', slug='new-tag')
+        ])
+        time.sleep(1.1)
+        response = self.client.get('/api/recipes/?tags=new-tag')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+
+
+def image_file(color):
+    buffer = BytesIO()
+    Image.new('RGB', (32, 32), color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='recipe.png')
+
+
+class TokenLogoutTest(TestCase):
+    """Токен не принимается после выхода и изменения пользователя."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ProjectUser.objects.create_user(
+            username='token', email='token@example.com', password='Pa55word!',
+            first_name='Имя', last_name='Фамилия',
+        )
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'token@example.com', 'password': 'Pa55word!',
+        })
+        self.key = response.data['auth_token']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_logout(self):
+        self.logout()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    @override_settings(CACHE_IS_SHARED=True)
+    def test_logout_shared_cache(self):
+        self.client.get('/api/users/me/')
+        local_tokens.clear()
+        self.client.get('/api/users/me/')
+        self.assertIsNotNone(cache.get(token_cache_key(self.key)))
+        self.logout()
+        self.assertIsNone(cache.get(token_cache_key(self.key)))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    @override_settings(CACHE_IS_SHARED=False)
+    def test_cache_of_other_process_ignored(self):
+        # Кэш в памяти другого процесса выход не сбрасывает:
+        # без общего кэша токены в кэше Django не хранятся.
+        self.assertIsNone(cache.get(token_cache_key(self.key)))
+        token = local_tokens.get(self.key)
+        self.logout()
+        cache.set(token_cache_key(self.key), token)
+        local_tokens.clear()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    @override_settings(CACHE_IS_SHARED=True)
+    def test_password_hash_not_cached(self):
+        local_tokens.clear()
+        self.client.get('/api/users/me/')
+        self.user.refresh_from_db()
+        for values in (local_tokens.get(self.key),
+                       cache.get(token_cache_key(self.key))):
+            self.assertNotIn(self.user.password, values)
+        # Хэш пароля загружается из БД при проверке.
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'Pa55word!', 'new_password': 'N3wPa55word!',
+        })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3wPa55word!'))
+
+    def test_login_keeps_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/login/', {
+                'email': 'token@example.com', 'password': 'Pa55word!',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(local_tokens.get(self.key))
+
+    def test_deactivated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertIsNone(local_tokens.get(self.key))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+class MetricsMiddlewareTest(TestCase):
+    """Метрики запросов в синхронном и асинхронном обработчике."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=3)
+
+    def setUp(self):
+        cache.clear()
+        # Соединение теста открыто раньше, чем асинхронный обработчик
+        # создает middleware в потоке цикла событий.
+        install_query_counter(connection)
+
+    @staticmethod
+    def sample(name, route='tags-list'):
+        labels = {} if name == 'api_requests_in_progress' else {
+            'route': route,
+        }
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def assert_recorded(self, get):
+        queries = self.sample('api_db_queries_per_request_sum')
+        requests = self.sample('api_db_queries_per_request_count')
+        in_progress = self.sample('api_requests_in_progress')
+        response = get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.sample('api_db_queries_per_request_count'), requests + 1
+        )
+        self.assertGreater(
+            self.sample('api_db_queries_per_request_sum'), queries
+        )
+        self.assertEqual(self.sample('api_requests_in_progress'), in_progress)
+
+    def test_sync(self):
+        self.assert_recorded(self.client.get)
+
+    def test_async(self):
+        async def get_response(request):
+            return None
+
+        # Без async_to_sync: Django вызывает middleware через await.
+        self.assertTrue(asyncio.iscoroutinefunction(
+            MetricsMiddleware(get_response)
+        ))
+        self.assert_recorded(async_to_sync(AsyncClient().get))
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1)
+class ProfilingMiddlewareTest(TestCase):
+    """Профилирование в синхронном и асинхронном обработчике."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(recipe_count=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_profiled(self, response, logs):
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        return json.loads(logs.records[-1].getMessage())
+
+    def test_sync(self):
+        with self.assertLogs('api.profiling') as logs:
+            response = self.client.get('/api/recipes/')
+        record = self.assert_profiled(response, logs)
+        self.assertGreater(record['queries'], 0)
+        self.assertIsNotNone(record['alloc_peak_kb'])
+
+    async def test_async(self):
+        with self.assertLogs('api.profiling') as logs:
+            response = await AsyncClient().get('/api/tags/')
+        self.assert_profiled(response, logs)
+
+    def test_concurrent_requests_skip_memory(self):
+        tracer = MemoryTracer()
+        profile = RequestProfile()
+        tracer.enter(profile)
+        tracer.enter()
+        tracer.exit()
+        self.assertIsNone(tracer.exit(profile))
+        tracer.enter(profile)
+        self.assertIsNotNone(tracer.exit(profile))
+
+
+class Base64JSONParserTest(TestCase):
+    """Экранирование JSON внутри строки с изображением."""
+
+    def parse(self, body):
+        return Base64JSONParser().parse(BytesIO(body.encode()))
+
+    def test_escapes(self):
+        content = bytes(range(256)) * 4
+        encoded = base64.encodebytes(content).decode()
+        self.assertIn('/', encoded)
+        body = json.dumps({
+            'name': 'Рецепт', 'image': f'data:image/png;base64,{encoded}',
+        }).replace('/', '\\/').replace('\\n', '\\r\\n')
+        for chunk_size in (7, 64 * 1024):
+            with self.subTest(chunk_size=chunk_size), mock.patch(
+                'api.parsers.CHUNK_SIZE', chunk_size
+            ):
+                data = self.parse(body)
+                self.assertEqual(data['name'], 'Рецепт')
+                self.assertEqual(data['image'].content_type, 'image/png')
+                self.assertEqual(data['image'].read(), content)
+
+    def test_unicode_escape(self):
+        data = self.parse(
+            '{"image": "data:image/png;base64,AA\\u003d\\u003d"}'
+        )
+        self.assertEqual(data['image'].read(), b'\x00')
+
+    def test_escaped_quote(self):
+        with self.assertRaises(ParseError):
+            self.parse('{"image": "data:image/png;base64,AA\\"=="}')
+
+    def test_surrogate_pair(self):
+        emoji = '\U0001f600'.encode()
+        self.assertEqual(unescape(b'\\ud83d\\ude00'), (emoji, b''))
+        # Пара, разорванная между частями, раскрывается целиком.
+        data, carry = unescape(b'A\\ud83d\\ude')
+        self.assertEqual((data, carry), (b'A', b'\\ud83d\\ude'))
+        self.assertEqual(unescape(carry + b'00B'), (emoji + b'B', b''))
+
+    def test_invalid_surrogates(self):
+        for escapes in ('\\ud83d', '\\ude00', '\\ud83d\\u0041',
+                        '\\ud83d\\ude00'):
+            body = f'{{"image": "data:image/png;base64,{escapes}AAAA"}}'
+            for chunk_size in (7, 64 * 1024):
+                with self.subTest(escapes=escapes, chunk_size=chunk_size), \
+                        mock.patch('api.parsers.CHUNK_SIZE', chunk_size), \
+                        self.assertRaises(ParseError):
+                    self.parse(body)
+
+
+@override_settings(IMAGE_RENDITIONS_ASYNC=False)
+class RenditionFilesTest(TestCase):
+    """Версии изображения не остаются на диске после замены и удаления."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, _, _ = create_catalog(recipe_count=0)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def save_image(self, recipe, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image = image_file(color)
+            recipe.save()
+        recipe.refresh_from_db()
+        return [
+            path for name, path in recipe.image_renditions.items()
+            if name != 'source'
+        ]
+
+    def test_old_renditions_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                name='С фото', author=self.users[0], text='Описание',
+                cooking_time=10,
+            )
+        old = self.save_image(recipe, 'red')
+        self.assertTrue(all(map(default_storage.exists, old)))
+        new = self.save_image(recipe, 'blue')
+        self.assertTrue(all(map(default_storage.exists, new)))
+        self.assertFalse(any(map(default_storage.exists, old)))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(any(map(default_storage.exists, new)))
+
+
+class SimilarRecipesTest(TestCase):
+    """Похожие рецепты совпадают с косинусным сходством, посчитанным в лоб."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users, _, _ = create_catalog(recipe_count=10)
+        fans = [
+            ProjectUser.objects.create(
+                username=f'similar{number}',
+                email=f'similar{number}@example.com',
+            )
+            for number in range(6)
+        ]
+        for offset, recipe in enumerate(Recipe.objects.order_by('id')):
+            for number, fan in enumerate(fans):
+                if (offset + number) % 3 == 0 or offset % (number + 2) == 0:
+                    FavouriteRecipe.objects.create(user=fan, recipe=recipe)
+
+    def brute_force(self, top_k):
+        fans = {}
+        for user_id, recipe_id in FavouriteRecipe.objects.values_list(
+            'user_id', 'recipe_id'
+        ):
+            fans.setdefault(recipe_id, set()).add(user_id)
+        scores = {}
+        for recipe_id, users in fans.items():
+            for other_id, others in fans.items():
+                common = len(users & others)
+                if other_id != recipe_id and common:
+                    scores[recipe_id, other_id] = (
+                        common / (len(users) * len(others)) ** 0.5
+                    )
+        best = {
+            recipe_id: sorted(
+                (score for (first, _), score in scores.items()
+                 if first == recipe_id),
+                reverse=True,
+            )[:top_k]
+            for recipe_id in fans
+        }
+        return scores, best
+
+    def assert_brute_force(self):
+        scores, best = self.brute_force(top_k=3)
+        stored = {}
+        for recipe_id, similar_id, score in SimilarRecipe.objects.values_list(
+            'recipe_id', 'similar_id', 'score'
+        ):
+            self.assertAlmostEqual(
+                score, scores[recipe_id, similar_id], places=5,
+            )
+            stored.setdefault(recipe_id, []).append(score)
+        self.assertEqual(stored.keys(), {
+            recipe_id for recipe_id, top in best.items() if top
+        })
+        for recipe_id, top in stored.items():
+            self.assertEqual(
+                [round(score, 5) for score in sorted(top, reverse=True)],
+                [round(score, 5) for score in best[recipe_id]],
+            )
+
+    def test_top_k_scores(self):
+        # Маленькие порции и блоки: в расчете несколько порций избранного
+        # и несколько блоков произведения.
+        build_similar_recipes(top_k=3, chunk_size=4, block_size=3)
+        self.assert_brute_force()
+
+    def test_favorite_deleted_during_build(self):
+        read_chunks = recommendations.read_chunks
+        deleted = FavouriteRecipe.objects.order_by('-id').first()
+
+        def delete_after_counting(queryset, key, *args):
+            if key == 'id':
+                deleted.delete()
+            return read_chunks(queryset, key, *args)
+
+        with mock.patch(
+            'api.recommendations.read_chunks',
+            side_effect=delete_after_counting,
+        ):
+            build_similar_recipes(top_k=3, chunk_size=4, block_size=3)
+        self.assert_brute_force()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Планы запросов PostgreSQL.')
+class QueryPlanTest(TestCase):
+    """
+    Запросы списков с фильтрами и ингредиентов идут по индексам:
+    в EXPLAIN запросов с условием или LIMIT нет Seq Scan по большим
+    таблицам (справочники тэгов и ингредиентов могут читаться целиком).
+    """
+    RECIPES = 10000
+    USERS = 5000
+    TAGS = 20
+    INGREDIENTS = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        ProjectUser.objects.bulk_create([
+            ProjectUser(
+                username=f'plan{number}',
+                email=f'plan{number}@example.com',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for number in range(cls.USERS)
+        ])
+        users = list(ProjectUser.objects.order_by('id'))
+        Tag.objects.bulk_create([
+            Tag(name=f'Тэг {number}', color=f'#{number:06d}',
+                slug=f'plan-tag{number}')
+            for number in range(cls.TAGS)
+        ])
+        tags = list(Tag.objects.order_by('id'))
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(cls.INGREDIENTS)
+        ])
+        ingredients = list(Ingredient.objects.order_by('id'))
+        Recipe.objects.bulk_create([
+            Recipe(
+                name=f'План {number}',
+                author=users[number % cls.USERS],
+                text='Описание',
+                cooking_time=10,
+            )
+            for number in range(cls.RECIPES)
+        ], batch_size=1000)
+        recipes = list(Recipe.objects.order_by('id'))
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(
+                recipe_id=recipe.id, tag_id=tags[number % cls.TAGS].id,
+            )
+            for number, recipe in enumerate(recipes)
+        ], batch_size=1000)
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient=ingredients[(number * 7 + offset) % len(
+                    ingredients
+                )],
+                amount=100,
+            )
+            for number, recipe in enumerate(recipes)
+            for offset in range(5)
+        ], batch_size=1000)
+        FavouriteRecipe.objects.bulk_create([
+            FavouriteRecipe(
+                user=user, recipe=recipes[(number * 37 + offset * 101) % (
+                    cls.RECIPES
+                )],
+            )
+            for number, user in enumerate(users)
+            for offset in range(10)
+        ], batch_size=1000, ignore_conflicts=True)
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(
+                user=user, recipe=recipes[(number * 53 + offset * 89) % (
+                    cls.RECIPES
+                )],
+            )
+            for number, user in enumerate(users)
+            for offset in range(5)
+        ], batch_size=1000, ignore_conflicts=True)
+        Subscribe.objects.bulk_create([
+            Subscribe(user=user, author=users[(number + offset) % cls.USERS])
+            for number, user in enumerate(users)
+            for offset in range(1, 11)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = users[0]
+        cls.tag = tags[0]
+        cls.ingredient = ingredients[0]
+
+    def setUp(self):
+        cache.clear()
+        # Справочник тэгов читается целиком и кэшируется: не проверяем.
+        get_tag_ids_by_slug()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_index_scans(self, url, allow_count_scan=False):
+        """
+        allow_count_scan - подсчет строк для пагинации может читать
+        таблицу целиком, если фильтр выбирает заметную ее долю.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or (
+                ' WHERE ' not in sql and ' LIMIT ' not in sql
+            ) or (allow_count_scan and sql.startswith('SELECT COUNT(*)')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            self.assertIsNone(
+                SEQ_SCAN_RE.search(plan), f'{url}\n{sql}\n{plan}'
+            )
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def test_recipe_list(self):
+        self.assert_index_scans('/api/recipes/?limit=6')
+
+    def test_recipe_list_filters(self):
+        for query in (
+            f'author={self.user.id}',
+            'is_favorited=1',
+            'is_in_shopping_cart=1',
+        ):
+            with self.subTest(query=query):
+                self.assert_index_scans(f'/api/recipes/?limit=6&{query}')
+
+    def test_recipe_list_tag_filter(self):
+        # Тэг есть у каждого двадцатого рецепта: страница читается
+        # по индексам, а общее число таких рецептов PostgreSQL
+        # обоснованно считает полным проходом по таблице рецептов.
+        self.assert_index_scans(
+            f'/api/recipes/?limit=6&tags={self.tag.slug}',
+            allow_count_scan=True,
+        )
+
+    def test_subscriptions(self):
+        self.assert_index_scans('/api/users/subscriptions/')
+
+    def test_ingredients(self):
+        self.assert_index_scans(f'/api/ingredients/{self.ingredient.id}/')
@@ -1,20 +1,44 @@
+from django.conf import settings
 from django.urls import include, path
+from django.urls.resolvers import URLPattern
 from rest_framework.routers import DefaultRouter
 
-from api.views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                       TagViewSet)
+from api.async_views import to_async
+from api.views import (CustomUserViewSet, FeedViewSet, IngredientViewSet,
+                       RecipeViewSet, TagViewSet)
 
 app_name = 'api'
 
+# Маршруты, которые в режиме ASGI обслуживаются асинхронными view.
+ASYNC_ROUTES = (
+    'recipes-list',
+    'recipes-detail',
+    'tags-list',
+    'tags-detail',
+    'ingredients-list',
+    'ingredients-detail',
+    'feed-list',
+)
+
 v1_router = DefaultRouter()
 
 v1_router.register(r'users', CustomUserViewSet, basename='users')
 v1_router.register(r'ingredients', IngredientViewSet, basename='ingredients')
 v1_router.register(r'tags', TagViewSet, basename='tags')
 v1_router.register(r'recipes', RecipeViewSet, basename='recipes')
+v1_router.register(r'feed', FeedViewSet, basename='feed')
+
+router_urls = v1_router.urls
+if settings.ASYNC_VIEWS:
+    router_urls = [
+        URLPattern(
+            url.pattern, to_async(url.callback), url.default_args, url.name,
+        ) if url.name in ASYNC_ROUTES else url
+        for url in router_urls
+    ]
 
 urlpatterns = [
-    path('', include(v1_router.urls)),
+    path('', include(router_urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -0,0 +1,81 @@
+from django.db.models import Model, QuerySet
+from rest_framework.permissions import SAFE_METHODS
+
+from recipes.models import FavouriteRecipe, Recipe, ShoppingCart
+from users.models import Subscribe
+
+
+class ViewerState:
+    """
+    Флаги текущего пользователя (избранное, список покупок, подписки)
+    для всех рецептов и авторов страницы ответа.
+    Каждый набор загружается одним запросом с IN (...).
+    """
+
+    def __init__(self, favorited=(), in_shopping_cart=(), subscribed=()):
+        self.favorited = set(favorited)
+        self.in_shopping_cart = set(in_shopping_cart)
+        self.subscribed = set(subscribed)
+
+    @classmethod
+    def load(cls, user, objects):
+        if user.is_anonymous:
+            return cls()
+        if isinstance(objects, Model):
+            objects = [objects]
+        recipe_ids = set()
+        author_ids = set()
+        for obj in objects:
+            if isinstance(obj, Recipe):
+                recipe_ids.add(obj.id)
+                if obj.author_id:
+                    author_ids.add(obj.author_id)
+            else:
+                author_ids.add(obj.id)
+        return cls(
+            favorited=cls._ids(
+                FavouriteRecipe, user, 'recipe_id', recipe_ids
+            ),
+            in_shopping_cart=cls._ids(
+                ShoppingCart, user, 'recipe_id', recipe_ids
+            ),
+            subscribed=cls._ids(
+                Subscribe, user, 'author_id', author_ids
+            ),
+        )
+
+    @staticmethod
+    def _ids(model, user, field, ids):
+        if not ids:
+            return ()
+        return model.objects.filter(
+            user=user, **{f'{field}__in': ids}
+        ).values_list(field, flat=True)
+
+    def is_favorited(self, recipe):
+        return recipe.id in self.favorited
+
+    def is_in_shopping_cart(self, recipe):
+        return recipe.id in self.in_shopping_cart
+
+    def is_subscribed(self, author):
+        return author.id in self.subscribed
+
+
+class ViewerStateMixin:
+    """
+    Добавляет в контекст сериализатора ViewerState,
+    собранный по объектам страницы (для безопасных методов).
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.request.method in SAFE_METHODS:
+            instance = args[0]
+            if isinstance(instance, QuerySet):
+                instance = list(instance)
+            args = (instance,) + args[1:]
+            context = kwargs.setdefault(
+                'context', self.get_serializer_context()
+            )
+            context['viewer'] = ViewerState.load(self.request.user, instance)
+        return super().get_serializer(*args, **kwargs)
@@ -1,30 +1,57 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, prefetch_related_objects
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import filters, serializers, status
+from rest_framework import mixins, serializers, status
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
-
+from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
+                                     ReadOnlyModelViewSet)
+
+from api.async_views import is_asgi_request
+from api.cache import (INGREDIENTS_GENERATION_KEY, TAGS_GENERATION_KEY,
+                       AnonymousCacheMixin, get_generation,
+                       get_tag_ids_by_slug)
+from api.conditional import ConditionalGetMixin
+from api.feed import fan_out, pull_popular
 from api.filters import RecipeFilter
-from api.pagination import ProjectPagination
+from api.indexes import ingredient_index, pantry_index
+from api.pagination import (FeedPagination, PantryPagination,
+                            ProjectPagination)
+from api.parsers import Base64JSONParser
 from api.permissions import IsAdminAuthorOrReadOnly
+from api.renderers import CSVRenderer, PlainTextRenderer
 from api.serializers import (FavoriteSerializer, IngredientSerializer,
+                             PantryRecipeSerializer, PantrySerializer,
                              ProjectUserSerializer, ReadRecipeSerializer,
                              RecordRecipeSerializer, SmallRecipeSerializer,
-                             SubscribeSerializer, TagSerializer)
-from recipes.models import (FavouriteRecipe, Ingredient, IngredientInRecipe,
-                            Recipe, ShoppingCart, Tag)
+                             SubscribeSerializer, TagSerializer,
+                             recipe_prefetches, recipe_previews)
+from api.shopping_cart import EXPORTERS, shopping_cart_rows
+from api.viewer import ViewerState, ViewerStateMixin
+from recipes.models import (FavouriteRecipe, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, Tag)
 from users.models import Subscribe
 
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
+def parse_pk(value):
+    """Числовой id из адреса или None, если id не число."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CustomUserViewSet(ViewerStateMixin, UserViewSet):
     """
     Вьюсет для работы с пользователями
     (создание, редактирование, смена пароля),
@@ -80,15 +107,20 @@ class CustomUserViewSet(UserViewSet):
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         queryset = User.objects.filter(subscribing__user=request.user)
+        page = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(
-            self.paginate_queryset(queryset),
+            page,
             many=True,
-            context={'request': request},
+            context={
+                'request': request,
+                'viewer': ViewerState.load(request.user, page),
+                'recipe_previews': recipe_previews(page, request),
+            },
         )
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     """
     Вьюсет для работы с ингридиентами
     (редактирование - админ,
@@ -97,11 +129,28 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = [filters.SearchFilter]
-    search_fields = ('^name',)
 
+    def get_conditional_state(self, request, *args, **kwargs):
+        return (
+            request.get_full_path(),
+            get_generation(INGREDIENTS_GENERATION_KEY),
+        ), None
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('name'):
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(
+            self.autocomplete, request, *args, **kwargs
+        )
+
+    def autocomplete(self, request, *args, **kwargs):
+        return Response(ingredient_index.search(
+            request.query_params['name'],
+            settings.INGREDIENT_SEARCH_LIMIT,
+        ))
 
-class TagViewSet(ReadOnlyModelViewSet):
+
+class TagViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     """
     Вьюсет для работы с тэгами для рецептов
     (редактирование - админ,
@@ -111,8 +160,15 @@ class TagViewSet(ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     pagination_class = None
 
+    def get_conditional_state(self, request, *args, **kwargs):
+        return (
+            request.get_full_path(),
+            get_generation(TAGS_GENERATION_KEY),
+        ), None
+
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                    ViewerStateMixin, ModelViewSet):
     """
     Вьюсет для работы с основными возможностями проекта
     (создание, удаление и редактирование рецептов - админ и автор;
@@ -125,15 +181,74 @@ class RecipeViewSet(ModelViewSet):
     pagination_class = ProjectPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    parser_classes = [Base64JSONParser, FormParser, MultiPartParser]
     http_method_names = ['get', 'post', 'patch', 'create', 'delete']
 
+    def get_queryset(self):
+        return Recipe.objects.select_related('author').prefetch_related(
+            *recipe_prefetches()
+        ).defer('search_vector')
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        pk = parse_pk(kwargs.get('pk'))
+        if self.action != 'retrieve' or pk is None:
+            return None, None
+        user = request.user
+        if user.is_anonymous:
+            state = self.get_anonymous_state(pk)
+        else:
+            state = self.get_viewer_state(pk, user)
+        if state is None:
+            return None, None
+        return (
+            request.get_full_path(),
+            user.pk,
+            *state,
+            get_generation(TAGS_GENERATION_KEY),
+            get_generation(INGREDIENTS_GENERATION_KEY),
+        ), state[0] if user.is_anonymous else None
+
+    @staticmethod
+    def get_anonymous_state(pk):
+        """
+        Дата изменения рецепта для анонима. Хранится в кэше под текущим
+        поколением рецептов: закэшированный ответ обходится без БД.
+        """
+        key = f'recipes:{get_generation()}:updated_at:{pk}'
+        state = cache.get(key)
+        if state is None:
+            state = Recipe.objects.filter(pk=pk).values_list(
+                'updated_at'
+            ).first()
+            if state is not None:
+                cache.set(key, state, settings.RECIPES_CACHE_TIMEOUT)
+        return state
+
+    @staticmethod
+    def get_viewer_state(pk, user):
+        """Дата изменения рецепта и отметки пользователя для ETag."""
+        return Recipe.objects.filter(pk=pk).annotate(
+            is_favorited=Exists(FavouriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'),
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'),
+            )),
+            is_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author'),
+            )),
+        ).values_list(
+            'updated_at', 'is_favorited', 'is_in_shopping_cart',
+            'is_subscribed',
+        ).first()
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return ReadRecipeSerializer
         return RecordRecipeSerializer
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        fan_out(serializer.save(author=self.request.user))
 
     def update(self, request, *args, **kwargs):
         kwargs['partial'] = False
@@ -214,26 +329,96 @@ class RecipeViewSet(ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated],)
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer])
     def download_shopping_cart(self, request, **kwargs):
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit',
-        ).annotate(amount=Sum('amount'))
-
-        shopping_cart = (
-            f'Список покупок для: {request.user.get_full_name()}\n\n'
+        file_format = request.accepted_renderer.format
+        export, content_type = EXPORTERS[file_format]
+        filename = f'{request.user.username}_shopping_cart.{file_format}'
+        rows = shopping_cart_rows(request.user)
+        if is_asgi_request(request):
+            # В ASGI Django 3.2 перебирает потоковый ответ в цикле событий,
+            # где обращения к БД запрещены: читаем строки заранее.
+            rows = list(rows)
+        response = StreamingHttpResponse(
+            export(request.user, rows), content_type=content_type,
         )
-        shopping_cart += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ])
-
-        filename = f'{request.user.username}_shopping_cart.txt'
-        response = HttpResponse(shopping_cart, content_type='text/plain')
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
+
+    @action(detail=True, methods=['get'], pagination_class=None)
+    def similar(self, request, **kwargs):
+        """Похожие рецепты из таблицы build_recommendations."""
+        pk = parse_pk(kwargs['pk'])
+        if pk is None:
+            raise Http404
+        recipes = Recipe.objects.filter(
+            similar_to__recipe_id=pk,
+        ).order_by('-similar_to__score').only(
+            'id', 'name', 'image', 'image_renditions', 'cooking_time',
+        )[:settings.SIMILAR_RECIPES_LIMIT]
+        if not recipes and not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response(SmallRecipeSerializer(
+            recipes, many=True, context={'request': request},
+        ).data)
+
+    @action(detail=False, methods=['get'], url_path='by-ingredients',
+            pagination_class=PantryPagination)
+    def by_ingredients(self, request):
+        """
+        Рецепты из имеющихся ингредиентов (?ingredients=1&ingredients=2):
+        сначала те, для которых есть все или почти все ингредиенты.
+        """
+        params = PantrySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        tag_ids = None
+        if 'tags' in params.validated_data:
+            slugs = get_tag_ids_by_slug()
+            tag_ids = {
+                slugs[slug] for slug in params.validated_data['tags']
+                if slug in slugs
+            }
+        page = self.paginate_queryset(pantry_index.search(
+            params.validated_data['ingredients'],
+            tag_ids,
+            params.validated_data.get('max_missing'),
+        ))
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_renditions', 'cooking_time',
+        ).in_bulk([pk for _, _, pk in page])
+        serializer = PantryRecipeSerializer(
+            [recipes[pk] for _, _, pk in page if pk in recipes],
+            many=True,
+            context={
+                'request': request,
+                'pantry': {
+                    pk: (coverage, missing)
+                    for coverage, missing, pk in page
+                },
+            },
+        )
+        return self.get_paginated_response(serializer.data)
+
+
+class FeedViewSet(ViewerStateMixin, mixins.ListModelMixin, GenericViewSet):
+    """
+    Лента рецептов авторов, на которых подписан пользователь.
+    Читается диапазоном по индексу ленты, с курсорной пагинацией.
+    """
+    serializer_class = ReadRecipeSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination
+
+    def get_queryset(self):
+        return FeedEntry.objects.filter(
+            user=self.request.user
+        ).select_related('recipe__author').defer('recipe__search_vector')
+
+    def list(self, request, *args, **kwargs):
+        pull_popular(request.user)
+        entries = self.paginate_queryset(self.get_queryset())
+        recipes = [entry.recipe for entry in entries]
+        prefetch_related_objects(recipes, *recipe_prefetches())
+        serializer = self.get_serializer(recipes, many=True)
+        return self.get_paginated_response(serializer.data)
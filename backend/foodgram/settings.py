@@ -36,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,13 +76,106 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        # Постоянные соединения: время жизни в секундах (0 - новое на каждый запрос).
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', 60),
+        # pgbouncer в режиме transaction не поддерживает курсоры на стороне
+        # сервера (QuerySet.iterator() при выгрузке списка покупок).
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_POOL_MODE') == 'transaction',
     }
     #'default': {
         #'ENGINE': 'django.db.backends.sqlite3',
         #'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     #}
 }
+# Проверять переиспользуемое соединение с БД в начале каждого запроса.
+DB_HEALTH_CHECKS = env.bool('DB_HEALTH_CHECKS', True)
+
+# Кэш: в продакшене - общий для всех процессов Redis-совместимый сервер,
+# без REDIS_URL (локальная разработка, тесты) - в памяти процесса.
+CACHE_IS_SHARED = bool(os.getenv('REDIS_URL'))
+if CACHE_IS_SHARED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Время жизни закэшированных ответов по рецептам для анонимов (секунды).
+RECIPES_CACHE_TIMEOUT = env.int('RECIPES_CACHE_TIMEOUT', 300)
+
+# Время жизни справочника тэгов для фильтра рецептов (секунды).
+TAGS_CACHE_TIMEOUT = env.int('TAGS_CACHE_TIMEOUT', 60)
+
+# Максимум ингредиентов в ответе автодополнения.
+INGREDIENT_SEARCH_LIMIT = env.int('INGREDIENT_SEARCH_LIMIT', 50)
+
+# Обработка изображений рецептов в отдельных процессах.
+IMAGE_WORKERS = env.int('IMAGE_WORKERS', 2)
+IMAGE_RENDITIONS_ASYNC = env.bool('IMAGE_RENDITIONS_ASYNC', True)
+# Формат уменьшенных версий: WEBP или JPEG.
+IMAGE_RENDITION_FORMAT = os.getenv('IMAGE_RENDITION_FORMAT', 'WEBP')
+
+# Ограничения загружаемых изображений: размер в байтах и число пикселей.
+MAX_IMAGE_UPLOAD_SIZE = env.int('MAX_IMAGE_UPLOAD_SIZE', 10 * 1024 * 1024)
+MAX_IMAGE_PIXELS = env.int('MAX_IMAGE_PIXELS', 40_000_000)
+# Сколько байт декодированного изображения держать в памяти до записи на диск.
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+# Режим ASGI: горячие read-эндпоинты обслуживаются асинхронными view,
+# запросы к БД выполняются в пуле из ASYNC_DB_THREADS потоков.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', False)
+ASYNC_DB_THREADS = env.int('ASYNC_DB_THREADS', 8)
+
+# Кэш токенов авторизации: в общем кэше (секунды, только с REDIS_URL)
+# и в памяти процесса.
+AUTH_TOKEN_CACHE_TIMEOUT = env.int('AUTH_TOKEN_CACHE_TIMEOUT', 300)
+AUTH_TOKEN_LOCAL_TTL = env.int('AUTH_TOKEN_LOCAL_TTL', 5)
+AUTH_TOKEN_LOCAL_SIZE = 1024
+
+# Лента подписок: авторам с числом подписчиков от FEED_FANOUT_LIMIT
+# рецепты не рассылаются, а подтягиваются в ленту при чтении.
+FEED_FANOUT_LIMIT = env.int('FEED_FANOUT_LIMIT', 1000)
+# Сколько последних рецептов автора добавить в ленту при подписке.
+FEED_BACKFILL = 50
+
+# Сколько похожих рецептов отдавать в /api/recipes/{id}/similar/.
+SIMILAR_RECIPES_LIMIT = env.int('SIMILAR_RECIPES_LIMIT', 10)
+
+# Сколько ингредиентов можно передать в /api/recipes/by-ingredients/.
+PANTRY_MAX_INGREDIENTS = env.int('PANTRY_MAX_INGREDIENTS', 100)
+
+# Профилирование запросов: доля замеряемых запросов от 0 до 1
+# (0 - middleware отключена). Запрос, выполненный одинаковым
+# SQL не менее PROFILING_DUPLICATE_THRESHOLD раз, считается N+1.
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', 0)
+PROFILING_DUPLICATE_THRESHOLD = env.int('PROFILING_DUPLICATE_THRESHOLD', 2)
+
+# Метрики Prometheus по адресу /metrics (доступен только внутри
+# сети контейнеров: nginx этот адрес не проксирует).
+METRICS_ENABLED = env.bool('METRICS_ENABLED', True)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
 
 # Указываем ссылку на модель "пользователя" проекта в константе.
 AUTH_USER_MODEL = 'users.ProjectUser'
@@ -106,7 +201,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_FILTER_BACKENDS': [
@@ -0,0 +1,45 @@
+# Настройки gunicorn. Режим выбирается переменной окружения ASYNC_VIEWS:
+# по умолчанию - синхронные воркеры (WSGI), при ASYNC_VIEWS=True -
+# воркеры uvicorn (ASGI) с асинхронными read-эндпоинтами.
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1
+))
+
+# Поколения кэша, справочник тэгов и отзыв токенов должны быть общими
+# для всех процессов: несколько воркеров без Redis отдавали бы
+# устаревшие данные и принимали бы отозванные токены.
+if workers > 1 and not os.getenv('REDIS_URL'):
+    raise RuntimeError(
+        f'GUNICORN_WORKERS={workers} требует общий кэш: укажите REDIS_URL '
+        'или запустите один воркер (GUNICORN_WORKERS=1).'
+    )
+
+if os.getenv('ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes', 'on'):
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'foodgram.asgi:application'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+
+# Метрики Prometheus: процессы-воркеры пишут их в общий каталог,
+# /metrics любого воркера отдает сумму по всем процессам.
+prometheus_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus'
+)
+
+
+def on_starting(server):
+    """Удаляет метрики процессов предыдущего запуска."""
+    os.makedirs(prometheus_dir, exist_ok=True)
+    for name in os.listdir(prometheus_dir):
+        if name.endswith('.db'):
+            os.remove(os.path.join(prometheus_dir, name))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid, prometheus_dir)
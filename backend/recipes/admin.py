@@ -36,9 +36,10 @@ class RecipesAdmin(admin.ModelAdmin):
     readonly_fields = ('count_favorites',)
     search_fields = ('name',)
 
-    @admin.display(description='Добавлено в избранное')
+    @admin.display(description='Добавлено в избранное',
+                   ordering='favorites_count')
     def count_favorites(self, obj):
-        return obj.favorites_recipe.count()
+        return obj.favorites_count
 
     @admin.display(description='Ингридиенты')
     def ingredients_list(self, obj):
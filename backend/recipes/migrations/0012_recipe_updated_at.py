@@ -0,0 +1,29 @@
+# Generated by Django 3.2.15 on 2026-10-17 03:21
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_auto_20231218_0003'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='amount',
+            field=models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Не менее 1 единиц'), django.core.validators.MaxValueValidator(1000, message='Не более 1000')], verbose_name='Количество'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Не менее 1 единиц'), django.core.validators.MaxValueValidator(32000, message='Не более 32 000 минут!')], verbose_name='Время приготовления блюда'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.15 on 2026-10-17 03:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_recipes_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    apps.get_model('users', 'ProjectUser').objects.update(
+        recipes_count=Coalesce(Subquery(
+            Recipe.objects.filter(author=OuterRef('pk')).order_by()
+            .values('author').annotate(count=Count('pk')).values('count')
+        ), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20231214_1011'),
+        ('recipes', '0016_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_recipes_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.15 on 2026-10-17 03:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_followers_count(apps, schema_editor):
+    Subscribe = apps.get_model('users', 'Subscribe')
+    apps.get_model('users', 'ProjectUser').objects.update(
+        followers_count=Coalesce(Subquery(
+            Subscribe.objects.filter(author=OuterRef('pk')).order_by()
+            .values('author').annotate(count=Count('pk')).values('count')
+        ), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_projectuser_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_followers_count, migrations.RunPython.noop),
+    ]
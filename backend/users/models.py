@@ -31,6 +31,16 @@ class ProjectUser(AbstractUser):
         max_length=MAX_LENGTH_USER_MODEL,
         verbose_name='Твоя фамилия'
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = [
         'first_name',